@@ -1,79 +1,733 @@
+# osmnx, networkx, geopandas, matplotlib, folium, requests and tqdm are imported in the
+# functions that use them, so that classifying names doesn't load the OSM and plotting stacks
 import pandas as pd
+import numpy as np
 from unidecode import unidecode
-import osmnx as ox
-ox.config(use_cache=True, log_console=True)
-from osmnx import utils_graph
 import re
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-from matplotlib.colors import LinearSegmentedColormap
-from tqdm import tqdm
-import wikipedia
-wikipedia.set_rate_limiting(True)
-wikipedia.API_URL = 'https://en.wikipedia.org/w/api.php'
 from itertools import chain
 import json
-import folium
 import time
+import sys
+from types import MappingProxyType
+import os
+import hashlib
+import urllib.request
+import sqlite3
+import threading
+import tempfile
+import heapq
+import random
+from contextlib import contextmanager
+from xml.sax.saxutils import quoteattr
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# first names sources (INSEE for French names, NRS for English names)
+INSEE_URL = 'https://www.insee.fr/fr/statistiques/fichier/2540004/nat2019_csv.zip'
+NRS_URL = 'https://www.nrscotland.gov.uk/files//statistics/babies-names/19/babies-first-names-all-names-all-years.csv'
+GENDER_TABLE_VERSION = 2 # bump when the table building steps change
+CLASSIFIER_VERSION = 3 # bump when the classification steps change, to forget stored classifications
+WIKIPEDIA_API_URL = 'https://{lang}.wikipedia.org/w/api.php'
+SPLIT_PATTERN = re.compile(" |\-|\'") # separators used to split names into words
+NAME_SEPARATOR = ' ; ' # separator of the names of merged edges in normalized names
+
+# rules giving the word to search on Wikipedia for the road names without any known first name,
+# per language (see RuleSet for the syntax)
+RULES = {
+    'fr': ['* ?',                                           # 'Rue XX'
+           '* ? de|d|du * ...',                             # 'Rue XX de XX'
+           '* le|la|de|d ?'],                               # 'Rue de XX'
+    'it': ['<via> ?',                                       # 'Via XX'
+           '<via> di|de|del|della|dei|degli|delle ?'],      # 'Via della XX'
+    'en': ['? <road>',                                      # 'XX Street'
+           '? s <road>'],                                   # 'XX's Road'
+}
+# Wikipedia languages searched in turn for the words given by each set of rules
+RULE_LANGUAGES = {'fr': ('en', 'fr'), 'it': ('it', 'en'), 'en': ('en',)}
+WORD_CLASSES = {
+    'via': {'via', 'viale', 'piazza', 'piazzale', 'corso', 'vicolo', 'largo', 'strada', 'lungomare'},
+    'road': {'street', 'road', 'avenue', 'lane', 'drive', 'place', 'square', 'close', 'crescent', 'way',
+             'terrace', 'gardens', 'court', 'row', 'walk', 'grove'},
+}
+
+# OSM ways excluded from each network type, as regexes of tag values (same filters as osmnx)
+_NO_PRIVATE = {'area': 'yes', 'access': 'private'}
+NETWORK_FILTERS = {
+    'drive': dict(_NO_PRIVATE, highway='abandoned|bridleway|bus_guideway|construction|corridor|cycleway|elevator|'
+                                       'escalator|footway|path|pedestrian|planned|platform|proposed|raceway|service|'
+                                       'steps|track',
+                  motor_vehicle='no', motorcar='no',
+                  service='alley|driveway|emergency_access|parking|parking_aisle|private'),
+    'drive_service': dict(_NO_PRIVATE, highway='abandoned|bridleway|bus_guideway|construction|corridor|cycleway|'
+                                               'elevator|escalator|footway|path|pedestrian|planned|platform|proposed|'
+                                               'raceway|steps|track',
+                          motor_vehicle='no', motorcar='no',
+                          service='emergency_access|parking|parking_aisle|private'),
+    'walk': dict(_NO_PRIVATE, highway='abandoned|bus_guideway|construction|cycleway|motor|planned|platform|'
+                                      'proposed|raceway',
+                 foot='no', service='private'),
+    'bike': dict(_NO_PRIVATE, highway='abandoned|bus_guideway|construction|corridor|elevator|escalator|footway|'
+                                      'motor|planned|platform|proposed|raceway|steps',
+                 bicycle='no', service='private'),
+    'all': dict(_NO_PRIVATE, highway='abandoned|construction|planned|platform|proposed|raceway', service='private'),
+    'all_private': {'area': 'yes', 'highway': 'abandoned|construction|planned|platform|proposed|raceway'},
+}
+
+
+class NameIndex:
+    """
+    Hash index of first names built once from a gender table (columns 'preusuel', 'sexe' and
+    optionally 'source'). Lookups are constant-time dict accesses: `get` returns the gender
+    (1 masc, 2 fem, 0 neutral) of a single token or None if the token isn't a known name,
+    `lookup` does the same for a list of tokens, `match` returns the position and gender of the
+    first known token of a road name and `first_match`/`first_matches` the gender only, for one
+    or several road names.
+
+    `find` also recognizes compound first names split into several tokens ('jean-baptiste',
+    'marie therese'), preferring the longest one. With `fuzzy=True`, an index of the names
+    with one letter deleted is built too, so that `fuzzy_get` finds the names at one edit
+    (insertion, deletion, substitution or transposition) of a token of at least
+    `min_fuzzy_length` letters, e.g. spelling variants, typos and plural or feminine forms.
+    """
+
+    def __init__(self, gender_table, fuzzy=False, min_fuzzy_length=5):
+        names = [sys.intern(str(n)) for n in gender_table['preusuel']]
+        genders = gender_table['sexe'].astype(int).tolist()
+        self._index = MappingProxyType(dict(zip(names, genders)))
+        if 'source' in gender_table.columns:
+            self._sources = MappingProxyType(dict(zip(names, gender_table['source'])))
+        else:
+            self._sources = MappingProxyType({})
+
+        # compound names, as tuples of tokens split like road names
+        self._compounds = {}
+        for name in names:
+            parts = tuple(p for p in SPLIT_PATTERN.split(name) if len(p) > 0)
+            if len(parts) > 1:
+                self._compounds[parts] = name
+        self._compound_starts = frozenset(parts[0] for parts in self._compounds)
+        self._max_parts = max((len(parts) for parts in self._compounds), default=1)
+
+        # single-token names by deletion of each of their letters (symmetric deletion index)
+        self.fuzzy = fuzzy
+        self.min_fuzzy_length = min_fuzzy_length
+        self._deletions = {}
+        if fuzzy:
+            for name in names:
+                if len(name) >= min_fuzzy_length - 1 and SPLIT_PATTERN.search(name) is None:
+                    for key in self.deletion_keys(name):
+                        self._deletions.setdefault(key, []).append(name)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, token):
+        return token in self._index
+
+    def __getitem__(self, token):
+        return self._index[token]
+
+    def get(self, token, default=None):
+        return self._index.get(token, default)
+
+    def items(self):
+        return self._index.items()
+
+    def source(self, token):
+        # table the token comes from ('insee', 'nrs', 'it' or 'custom')
+        return self._sources.get(token)
+
+    def lookup(self, tokens):
+        get = self._index.get
+        return [get(t) for t in tokens]
+
+    def match(self, tokens):
+        get = self._index.get
+        for i, t in enumerate(tokens):
+            g = get(t)
+            if g is not None:
+                return i, g
+        return None, None
+
+    def first_match(self, tokens):
+        return self.match(tokens)[1]
+
+    def first_matches(self, token_lists):
+        return [self.first_match(tokens) for tokens in token_lists]
+
+    def find(self, tokens):
+        # like `match`, with compound names: return the start and end positions of the first
+        # known name (the longest one at its position), its gender and its key in the index,
+        # or (None, None, None, None)
+        get = self._index.get
+        for i, t in enumerate(tokens):
+            if t in self._compound_starts:
+                for k in range(min(self._max_parts, len(tokens) - i), 1, -1):
+                    name = self._compounds.get(tuple(tokens[i:i+k]))
+                    if name is not None:
+                        return i, i + k, self._index[name], name
+            g = get(t)
+            if g is not None:
+                return i, i + 1, g, t
+        return None, None, None, None
+
+    @staticmethod
+    def deletion_keys(token):
+        # the token and the token with one letter deleted: two words at one edit share one of them
+        return {token} | {token[:i] + token[i+1:] for i in range(len(token))}
+
+    def fuzzy_get(self, token):
+        # gender and name of the known names at one edit of `token`, if they all have the
+        # same gender (None, None otherwise)
+        if not self.fuzzy or len(token) < self.min_fuzzy_length:
+            return None, None
+        candidates = set()
+        for key in self.deletion_keys(token):
+            candidates.update(n for n in self._deletions.get(key, ()) if _one_edit(token, n))
+        genders = {self._index[n] for n in candidates}
+        if len(genders) != 1:
+            return None, None
+        return genders.pop(), min(candidates)
+
+
+def _one_edit(a: str, b: str):
+    # True if a and b differ by at most one insertion, deletion, substitution or transposition
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i+1:] == b[i+1:] or (a[i+2:] == b[i+2:] and a[i:i+2] == b[i:i+2][::-1])
+    if len(a) < len(b):
+        a, b = b, a
+    return a[i+1:] == b[i:]
+
+
+class _RuleNode:
+    __slots__ = ['words', 'others', 'accept', 'rest']
+
+    def __init__(self):
+        self.words = {} # word -> child nodes, for literal slots
+        self.others = [] # (set of words or None for any word, child node), for other slots
+        self.accept = [] # rules ending at this node
+        self.rest = [] # rules ending at this node followed by any number of words
+
+
+class RuleSet:
+    """
+    Compiled set of rules giving the word to search on Wikipedia for the road names without
+    any known first name. Each rule is a pattern of space-separated slots matched against all
+    the words of a name: '*' is any word, '?' any word (the one to search), 'a|b' one of these
+    words, '<class>' one of the words of `word_classes[class]` and '...' (last slot only) any
+    number of words, including none. Rules are compiled once into a trie, walked in a single
+    pass over the words of each name; when several rules match, the first one wins.
+    """
+
+    def __init__(self, rules: list, word_classes=WORD_CLASSES):
+        self.rules = list(rules)
+        self.word_classes = word_classes
+        self._query_pos = []
+        self._root = _RuleNode()
+        for i, rule in enumerate(self.rules):
+            self._add(i, rule.split())
+
+    def _add(self, i: int, slots: list):
+        if slots.count('?') != 1 or '...' in slots[:-1]:
+            raise ValueError(f"Invalid rule '{' '.join(slots)}': it needs one '?' slot, and '...' can only be last.")
+        self._query_pos.append(slots.index('?'))
+        node = self._root
+        for slot in slots:
+            if slot == '...':
+                node.rest.append(i)
+                return
+            if slot in ['*', '?']:
+                words = None
+            elif slot.startswith('<') and slot.endswith('>'):
+                words = frozenset(self.word_classes[slot[1:-1]])
+            else:
+                words = slot.split('|')
+                if len(words) == 1: # literal words share their child node between rules
+                    node = node.words.setdefault(words[0], [_RuleNode()])[0]
+                    continue
+                words = frozenset(words)
+            child = next((c for w, c in node.others if w == words), None)
+            if child is None:
+                child = _RuleNode()
+                node.others.append((words, child))
+            node = child
+        node.accept.append(i)
+
+    @property
+    def key(self):
+        # identifies the rules, to forget stored classifications when they change
+        classes = {k: sorted(v) for k, v in self.word_classes.items()}
+        return hashlib.sha1(json.dumps([self.rules, classes], sort_keys=True).encode()).hexdigest()[:16]
+
+    def query(self, name: list):
+        matched = []
+        states = [self._root]
+        for word in name:
+            nexts = []
+            for node in states:
+                matched.extend(node.rest)
+                nexts.extend(node.words.get(word, []))
+                nexts.extend(c for w, c in node.others if w is None or word in w)
+            states = nexts
+            if len(states) == 0:
+                break
+        for node in states:
+            matched.extend(node.accept + node.rest)
+        if len(matched) == 0:
+            return None
+        return name[self._query_pos[min(matched)]]
+
+    def queries(self, names: list):
+        return [self.query(name) for name in names]
+
+
+class _SQLiteStore:
+    # base class of the persistent caches: a SQLite file shared by instances, threads and
+    # processes, with one connection per thread (sqlite connections can't be shared)
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('PRAGMA journal_mode=WAL')
+
+    def _connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=60)
+            self._local.con = con
+        return con
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class WikipediaCache(_SQLiteStore):
+    """
+    Persistent (language, query) -> search result titles cache, stored in a SQLite file
+    that can be shared by several StreetGender instances and processes. Entries older
+    than `ttl` seconds are treated as missing, and removed by `evict` each time the cache
+    is opened, so that the file doesn't grow across runs.
+    """
+
+    def __init__(self, path='cache/wikipedia.sqlite', ttl=30*24*3600):
+        super().__init__(path)
+        self.ttl = ttl
+        con = self._connection()
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS searches '
+                        '(lang TEXT, query TEXT, results TEXT, created REAL, PRIMARY KEY (lang, query))')
+        self.evict()
+
+    def __getstate__(self):
+        return {'path': self.path, 'ttl': self.ttl}
+
+    def get(self, lang: str, query: str):
+        row = self._connection().execute('SELECT results, created FROM searches WHERE lang=? AND query=?',
+                                         (lang, query)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, lang: str, query: str, results: list):
+        con = self._connection()
+        with con:
+            con.execute('INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)',
+                        (lang, query, json.dumps(list(results)), time.time()))
+
+    def evict(self):
+        con = self._connection()
+        with con:
+            n = con.execute('DELETE FROM searches WHERE created < ?', (time.time() - self.ttl,)).rowcount
+        return n
+
+    def clear(self):
+        con = self._connection()
+        with con:
+            con.execute('DELETE FROM searches')
+
+
+class ClassificationStore(_SQLiteStore):
+    """
+    Persistent normalized name -> (gender, source, token) classifications, stored in a SQLite
+    file shared by instances and processes. The source is 'table' (first names tables),
+    'custom' (custom_dict), 'wikipedia_en'/'wikipedia_fr'/... or 'neutral' (no rule applied), and
+    the token is the word that decided the gender. Each name also records the words it depends
+    on (its own words and the words of the Wikipedia results read), so that `sync` only forgets
+    the names depending on words added, removed or modified in the first names table.
+    Rows are keyed by `version` (classifier version, rules and options), so that instances
+    classifying differently can share the file without forgetting each other's names.
+    """
+
+    def __init__(self, path='cache/classifications.sqlite', version=CLASSIFIER_VERSION):
+        super().__init__(path)
+        self.version = str(version)
+        con = self._connection()
+        with con:
+            columns = [row[1] for row in con.execute('PRAGMA table_info(names)')]
+            if len(columns) > 0 and 'version' not in columns: # file written before the version column
+                for table in ['names', 'deps', 'tokens', 'meta']:
+                    con.execute(f'DROP TABLE IF EXISTS {table}')
+            con.execute('CREATE TABLE IF NOT EXISTS names '
+                        '(version TEXT, name TEXT, gender INTEGER, source TEXT, token TEXT, PRIMARY KEY (version, name))')
+            con.execute('CREATE TABLE IF NOT EXISTS deps (version TEXT, token TEXT, name TEXT)')
+            con.execute('CREATE INDEX IF NOT EXISTS deps_token ON deps (version, token)')
+            con.execute('CREATE INDEX IF NOT EXISTS deps_name ON deps (version, name)')
+            con.execute('CREATE TABLE IF NOT EXISTS tokens '
+                        '(version TEXT, token TEXT, gender INTEGER, source TEXT, PRIMARY KEY (version, token))')
+
+    def __getstate__(self):
+        return {'path': self.path, 'version': self.version}
+
+    def sync(self, name_index):
+        # forget the classifications of this version affected by the differences (gender or
+        # source) between the first names table they were computed with and `name_index`
+        con = self._connection()
+        with con:
+            current = {t: (g, name_index.source(t)) for t, g in name_index.items()}
+            previous = {t: (g, source) for t, g, source in
+                        con.execute('SELECT token, gender, source FROM tokens WHERE version=?', (self.version,))}
+            changed = [t for t in current.keys() | previous.keys() if current.get(t) != previous.get(t)]
+            # names depend on the first word of the compound names and, with fuzzy matching, on the
+            # deletion keys ('~' prefix) of their query, shared with the names at one edit
+            keys = set(changed)
+            for t in changed:
+                parts = [p for p in SPLIT_PATTERN.split(t) if len(p) > 0]
+                if len(parts) > 1:
+                    keys.add(parts[0])
+                elif name_index.fuzzy:
+                    keys.update('~' + k for k in name_index.deletion_keys(t))
+            keys = sorted(keys)
+            if len(changed) > 0:
+                con.execute('CREATE TEMP TABLE IF NOT EXISTS stale (name TEXT PRIMARY KEY)')
+                con.execute('DELETE FROM stale')
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i+500]
+                    con.execute('INSERT OR IGNORE INTO stale SELECT name FROM deps '
+                                f'WHERE version=? AND token IN ({",".join("?"*len(chunk))})', [self.version] + chunk)
+                con.execute('DELETE FROM names WHERE version=? AND name IN (SELECT name FROM stale)', (self.version,))
+                con.execute('DELETE FROM deps WHERE version=? AND name IN (SELECT name FROM stale)', (self.version,))
+                con.execute('DELETE FROM tokens WHERE version=?', (self.version,))
+                con.executemany('INSERT INTO tokens VALUES (?, ?, ?, ?)',
+                                [(self.version, t, g, source) for t, (g, source) in current.items()])
+        return len(changed)
+
+    def get(self, names: list):
+        con = self._connection()
+        found = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i+500]
+            rows = con.execute('SELECT name, gender, source, token FROM names '
+                               f'WHERE version=? AND name IN ({",".join("?"*len(chunk))})', [self.version] + chunk)
+            found.update((name, (gender, source, token)) for name, gender, source, token in rows)
+        return found
+
+    def save(self, records: list):
+        # records: list of (name, gender, source, token, words the classification depends on)
+        con = self._connection()
+        with con:
+            con.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?)', [(self.version,) + r[:4] for r in records])
+            con.executemany('DELETE FROM deps WHERE version=? AND name=?', [(self.version, r[0]) for r in records])
+            con.executemany('INSERT INTO deps VALUES (?, ?, ?)', [(self.version, t, r[0]) for r in records for t in set(r[4])])
+
+    def clear(self):
+        con = self._connection()
+        with con:
+            for table in ['names', 'deps', 'tokens']:
+                con.execute(f'DELETE FROM {table} WHERE version=?', (self.version,))
+
+
+def wikipedia_search(query: str, lang: str):
+    """
+    Default search backend: return the titles of the Wikipedia search results for `query`
+    in language `lang`. Any callable with the same signature can be passed to StreetGender
+    as `search_backend` (e.g. a local stand-in for tests or offline runs).
+    The MediaWiki API is called directly (same request as `wikipedia.search`) as the
+    `wikipedia` package stores the language globally and can't be used from several threads.
+    """
+    params = {'action': 'query', 'format': 'json', 'list': 'search', 'srprop': '',
+              'srlimit': 10, 'srsearch': query}
+    headers = {'User-Agent': 'StreetGender (https://github.com/tdemareuil/StreetGender)'}
+    import requests
+    r = requests.get(WIKIPEDIA_API_URL.format(lang=lang), params=params, headers=headers, timeout=30)
+    r.raise_for_status()
+    data = r.json()
+    if 'error' in data:
+        raise RuntimeError(f"Wikipedia search failed: {data['error'].get('info')}")
+    return [x['title'] for x in data['query']['search']]
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls to `wait` so that at most `rate` calls per second
+    go through, whatever the number of threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            t = max(now, self._next)
+            self._next = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+
+class Metrics:
+    """
+    Thread-safe instrumentation of a StreetGender run: total duration and number of calls of
+    each stage, event counters (optionally labelled, e.g. per language) and a sample of the
+    slowest street names to classify (`sample_rate` of the names are timed, and the
+    `slow_names` slowest ones are kept). Export with `to_json` or `to_prometheus`.
+    """
+
+    def __init__(self, slow_names=20, sample_rate=1.0):
+        self.max_slow_names = slow_names
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {} # stage -> [calls, seconds]
+            self.counters = {} # (name, labels) -> count
+            self._slow_names = [] # heap of (seconds, name, query)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                calls, total = self.stages.get(name, (0, 0.0))
+                self.stages[name] = [calls + 1, total + seconds]
+
+    def count(self, name: str, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def time_name(self, name: str, seconds: float, query=None):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if len(self._slow_names) < self.max_slow_names:
+                heapq.heappush(self._slow_names, (seconds, name, query))
+            elif seconds > self._slow_names[0][0]:
+                heapq.heapreplace(self._slow_names, (seconds, name, query))
+
+    @property
+    def slow_names(self):
+        with self._lock:
+            return [{'name': name, 'query': query, 'seconds': round(seconds, 4)}
+                    for seconds, name, query in sorted(self._slow_names, reverse=True)]
+
+    def to_dict(self):
+        with self._lock:
+            stages = {k: {'calls': calls, 'seconds': round(seconds, 4)} for k, (calls, seconds) in self.stages.items()}
+            counters = {name + ''.join(f'[{k}={v}]' for k, v in labels): n
+                        for (name, labels), n in sorted(self.counters.items())}
+        return {'stages': stages, 'counters': counters, 'slow_names': self.slow_names}
+
+    def to_json(self, path=None):
+        report = json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report)
+        return report
+
+    def to_prometheus(self, path=None, prefix='streetgender'):
+        # text exposition format, e.g. for the node exporter textfile collector
+        lines = [f'# TYPE {prefix}_stage_seconds_total counter', f'# TYPE {prefix}_stage_calls_total counter']
+        with self._lock:
+            for stage, (calls, seconds) in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+                lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {calls}')
+            for (name, labels), n in sorted(self.counters.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{prefix}_{name}_total{{{labels}}} {n}' if labels else f'{prefix}_{name}_total {n}')
+        report = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report)
+        return report
+
+
+class WikipediaResolver:
+    """
+    Resolve the gender of many Wikipedia queries concurrently. Each language has its own
+    queue: all queries are first searched on the first language, and only the ones still
+    unclassified are searched on the next one. Searches run in a pool of `workers` threads
+    through `fetch(query, lang)`, which is in charge of caching and rate limiting and returns
+    None if the results aren't available, and `classify(titles)` returns the gender found in
+    the titles of the results (or None), the word that decided it and the words read.
+    Results are returned as a dict query -> (gender, lang, token, words read, complete),
+    independently of the completion order; `complete` is False if a search failed.
+    """
+
+    def __init__(self, fetch, classify, languages=('en', 'fr'), workers=8, progress=True):
+        self.fetch = fetch
+        self.classify = classify
+        self.languages = languages
+        self.workers = workers
+        self.progress = progress
+
+    def resolve(self, queries):
+        found = {}
+        pending = sorted(set(queries))
+        words = {q: [] for q in pending}
+        complete = {q: True for q in pending}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for lang in self.languages:
+                if len(pending) == 0:
+                    break
+                results = pool.map(lambda q: self.fetch(q, lang), pending)
+                if self.progress:
+                    from tqdm import tqdm
+                    results = tqdm(results, total=len(pending), desc=f'Wikipedia ({lang})')
+                unresolved = []
+                for titles, q in zip(results, pending):
+                    if titles is None:
+                        complete[q] = False
+                    g, token, read = self.classify(titles or [])
+                    words[q] += read
+                    if g is None:
+                        unresolved.append(q)
+                    else:
+                        found[q] = (g, lang, token, words[q], complete[q])
+                pending = unresolved
+        for q in pending:
+            found[q] = (None, None, None, words[q], complete[q])
+        return found
+
+
+def _name_key(x):
+    # hashable key of a raw OSM name: the lists of names of merged edges become tuples,
+    # and missing names are kept as 'nan' (neutral in custom_dict)
+    if isinstance(x, str):
+        return x
+    if isinstance(x, (list, tuple)):
+        return tuple(x)
+    return 'nan'
+
+
+def _name_chunks(names, column='name', chunksize=10000):
+    # split raw names into lists of at most `chunksize` names, reading DataFrame chunks from `column`
+    if isinstance(names, (pd.DataFrame, pd.Series)):
+        names = [names]
+    chunk = []
+    for item in names:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            if len(chunk) > 0:
+                yield chunk
+                chunk = []
+            values = (item[column] if isinstance(item, pd.DataFrame) else item).tolist()
+            for i in range(0, len(values), chunksize):
+                yield values[i:i+chunksize]
+        else:
+            chunk.append(item)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+async def _aname_chunks(names, column='name', chunksize=10000):
+    # same as _name_chunks, for async iterables too
+    if not hasattr(names, '__aiter__'):
+        for chunk in _name_chunks(names, column, chunksize):
+            yield chunk
+        return
+    chunk = []
+    async for item in names:
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            if len(chunk) > 0:
+                yield chunk
+                chunk = []
+            for values in _name_chunks(item, column, chunksize):
+                yield values
+        else:
+            chunk.append(item)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+    if len(chunk) > 0:
+        yield chunk
 
 
 class StreetGender:
     
-    def __init__(self, place: str, network_type='drive'): # 'walk', 'bike', 'drive', 'all' or 'all_private'
-        
-        # download and clean INSEE's list of first names
-        genders = pd.read_csv('https://www.insee.fr/fr/statistiques/fichier/2540004/nat2019_csv.zip', sep=";")[['preusuel','sexe', 'nombre']]
-        genders['preusuel'] = genders['preusuel'].apply(lambda x: unidecode(str.lower(str(x))))
-        genders = genders.sort_values('nombre').drop_duplicates('preusuel', keep='last')
-        genders = genders[genders['nombre']>=100]
-        genders = genders[genders['preusuel']!='camille'] # remove Camille (2) as most street Camilles are men (1)
-        genders = genders[genders['preusuel']!='blanche']
-        genders = genders.reset_index(drop=True).drop(columns=['nombre'])
+    def __init__(self, place: str, network_type='drive', # 'walk', 'bike', 'drive', 'all' or 'all_private'
+                 cache_folder='cache', offline=False, refresh=False,
+                 search_backend=wikipedia_search, wikipedia_ttl=30*24*3600,
+                 wikipedia_rate=20, wikipedia_retries=3, gender_table=None,
+                 osm_file=None, boundary_file=None, stats_only=False, rules='fr', metrics=None,
+                 osmnx_settings=None, fuzzy=False, offline_search=False, languages=None):
         
-        # add English first names
-        genders_en = pd.read_csv('https://www.nrscotland.gov.uk/files//statistics/babies-names/19/babies-first-names-all-names-all-years.csv')[['sex','FirstForename','number']]
-        genders_en = genders_en[genders_en['number']>=20]
-        genders_en['preusuel'] = genders_en['FirstForename'].apply(lambda x: unidecode(str.lower(str(x))))
-        genders_en = genders_en.drop_duplicates('preusuel')
-        genders_en['sexe'] = genders_en['sex'].apply(lambda x: 1 if x=='B' else 2)
-        genders_en = genders_en.reset_index(drop=True).drop(columns=['FirstForename','number','sex'])
-
-        # add Italian first names
-        ragazzo = re.split(', |[.\n ]', ragazzo)
-		ragazzo = [x for x in ragazzo if len(x)>0]
-		ragazza = re.split(', |[.\n ]', ragazza)
-		ragazza = [x for x in ragazza if len(x)>0]
-		genders_it = {} 
-		for x in ragazzo:
-		    genders_it[x] = 1
-		for x in ragazza:
-		    genders_it[x] = 2
-		genders_it = pd.DataFrame.from_dict(genders_it, orient='index')
-		genders_it = genders_it.reset_index()
-		genders_it.columns = ['preusuel','sexe']
-
-        # complement the gender table
-        more_names = pd.DataFrame.from_dict(custom_dict, orient='index')
-        more_names = more_names.reset_index()
-        more_names.columns = ['preusuel','sexe']
-        genders = pd.concat([genders, more_names, genders_en, genders_it], axis=0)
-        genders['preusuel'] = genders['preusuel'].apply(lambda x: unidecode(str.lower(str(x))))
-        genders = genders.drop_duplicates('preusuel')
-        mistakes = ['france', 'alma', 'barbe', 'lilas', 'milan', 'brune', 'felicite',
-                    'nancy', 'grace', 'lorraine', 'evy', 'loup', 'iris',
-                    'colombe', 'jan', 'harmonie', 'julienne', 'abbey', 'andrea', 'kim',
-                    'brittany', 'river', 'line', 'lou', 'tracy', 'yvette', 'sonia',
-                    'india', 'leah', 'pamela', 'stacey', 'eliza', 'athena', 'prince',
-                    'violet', 'desiree', 'vivienne', 'charlie']
-        genders = genders[~genders['preusuel'].isin(mistakes)]
-        genders =  genders.reset_index(drop=True)
+        self.metrics = metrics if metrics is not None else Metrics() # stage durations, counters and slow names
+
+        # load the merged first names table (built once, then read from the local cache),
+        # unless an already loaded table is passed
+        if gender_table is not None:
+            genders = gender_table
+        else:
+            with self.metrics.stage('load_gender_table'):
+                genders = load_gender_table(cache_folder=cache_folder, offline=offline, refresh=refresh)
 
         self.gender_table = genders
+        self._own_gender_table = gender_table is None # False if the table was passed by the caller
+        self.name_index = NameIndex(genders, fuzzy=fuzzy) # fuzzy: also match the words at one edit of a first name
+        self.rules = RuleSet(RULES[rules] if isinstance(rules, str) else rules) # 'fr', 'it', 'en' or a list of rules
+        if languages is None: # Wikipedia languages searched, by default the ones of the rules
+            languages = RULE_LANGUAGES[rules] if isinstance(rules, str) else RULE_LANGUAGES['fr']
+        self.languages = tuple(languages)
         self.place = place
         self.network_type = network_type
+        self.osm_file = osm_file # local .osm.pbf or .osm extract used instead of the OSM APIs
+        self.boundary_file = boundary_file # polygon of the place in the local extract (any format read by geopandas)
+        self.stats_only = stats_only # build a compact table of OSM ways instead of the graph, until a plot is needed
+        self.cache_folder = cache_folder
+        self.offline = offline
+        # settings passed to ox.config before each OSM query of this instance
+        self.osmnx_settings = {'use_cache': True, 'log_console': True, 'cache_folder': cache_folder,
+                               **(osmnx_settings or {})}
+        self.search_backend = search_backend
+        self.offline_search = offline_search # search_backend doesn't use the network and may run in offline mode
+        self.wikipedia_cache = WikipediaCache(os.path.join(cache_folder, 'wikipedia.sqlite'), ttl=wikipedia_ttl)
+        self.wikipedia_retries = wikipedia_retries
+        self._rate_limiter = RateLimiter(wikipedia_rate) # max number of search requests per second
+        self.classification_store = ClassificationStore(os.path.join(cache_folder, 'classifications.sqlite'),
+                                                        self._classifier_version())
+        self.classification_store.sync(self.name_index)
         self._road_graph = None
         self._road_table = None
         self._road_genders = None
+        self.street_names = None # distinct normalized names with their tokens, gender and source
+        self._name_memo = {} # raw name -> normalized name
+        self._name_tokens = {} # normalized name -> list of words
+        self._name_genders = {} # normalized name -> gender
+        self._name_sources = {} # normalized name -> source of the classification
+        self._edge_genders = None # (u, v, key) -> gender
+        self._edge_gender_array = None # genders aligned with the edges of the road graph
+        self._edge_color_cache = None # (colors, edge colors aligned with the edges of the road graph)
+        self._edge_geometry_cache = None # (projected coordinates, offsets, names, lengths) of the edges
         print('Class instance initiated.')
        
     @property
@@ -81,9 +735,15 @@ class StreetGender:
         if self._road_graph is not None:
             return self._road_graph
         else:
-            print('Querying road graph from OSM...')
-            G = ox.graph_from_place(self.place, network_type=self.network_type)
-            G = ox.get_undirected(G)
+            with self.metrics.stage('road_graph'):
+                ox = self._osmnx()
+                if self.osm_file is not None:
+                    print(f'Reading road graph from {self.osm_file}...')
+                    G = graph_from_osm_file(self.osm_file, network_type=self.network_type, boundary_file=self.boundary_file)
+                else:
+                    print('Querying road graph from OSM...')
+                    G = ox.graph_from_place(self.place, network_type=self.network_type)
+                G = ox.get_undirected(G)
             self._road_graph = G
         print('Road graph successfully fetched.')
         return self._road_graph
@@ -93,90 +753,317 @@ class StreetGender:
     def road_table(self):
         if self._road_table is not None:
             return self._road_table
+        elif self.stats_only and self._road_graph is None:
+            # compact table of the OSM ways, without building the graph and geometries
+            with self.metrics.stage('road_table'):
+                if self.osm_file is not None:
+                    print(f'Reading road table from {self.osm_file}...')
+                    roads = edge_table_from_osm_file(self.osm_file, network_type=self.network_type,
+                                                     boundary_file=self.boundary_file)
+                else:
+                    print('Querying road table from OSM...')
+                    self._osmnx()
+                    roads = edge_table_from_place(self.place, network_type=self.network_type)
+            self._road_table = roads
+            return self._road_table
         else:
             if self._road_graph is not None:
                 G = self._road_graph
             else:
                 G = self.road_graph
-            roads = ox.graph_to_gdfs(G, nodes=False)[['name']]
+            with self.metrics.stage('graph_to_gdfs'):
+                roads = self._osmnx().graph_to_gdfs(G, nodes=False)[['u', 'v', 'key', 'name', 'length']]
             self._road_table = roads
             return self._road_table
 
 
-    def _classify_gender(self, name: list):
-        # set gender to neutral
-        g = None
+    def _osmnx(self):
+        # import osmnx on first use only, and apply the settings of this instance (osmnx keeps
+        # its settings globally, so they are applied again before each use)
+        import osmnx as ox
+        ox.config(**self.osmnx_settings)
+        return ox
 
-        # iterate through elements of the road name to try classifying
-        for el in name:
-            try:
-                g = int(self.gender_table[self.gender_table['preusuel']==el]['sexe'])
-                break
-            except:
+
+    def _normalize_names(self, names: pd.Series):
+        # normalize (lowercase, no accents) and tokenize each distinct raw name only once, and
+        # keep the results in memory for the next calls (classification and plots)
+        keys = names.astype(object).map(_name_key).to_numpy()
+        codes, uniques = pd.factorize(keys)
+        new = [k for k in uniques if k not in self._name_memo]
+        if len(new) > 0:
+            # list-valued names (edges merged by OSMnx) are joined with NAME_SEPARATOR, and each
+            # of their names is classified (see `_classify_names`)
+            raw = pd.Series([NAME_SEPARATOR.join(map(str, k)) if isinstance(k, tuple) else k for k in new],
+                            dtype=object)
+            normalized = raw.str.lower().map(unidecode)
+            tokens = normalized.str.split(SPLIT_PATTERN.pattern)
+            self._name_memo.update(zip(new, normalized))
+            self._name_tokens.update(zip(normalized, tokens))
+        normalized = np.array([self._name_memo[k] for k in uniques], dtype=object)
+        return pd.Series(normalized[codes], index=names.index, name='name_lower')
+
+
+    def _display_name(self, name):
+        # single street name shown for a raw OSM name: for the names of merged edges, the first
+        # one that decided the gender, or the first one in alphabetical order if all are neutral
+        if not isinstance(name, list):
+            return name
+        for x in name:
+            if self._name_genders.get(unidecode(str(x).lower()), 0) != 0:
+                return x
+        return min(name)
+
+
+    def _classify_names(self, names: list, workers=8, progress=True):
+        # classify the normalized names that weren't classified yet: read the ones already known
+        # from the persistent store, classify the others offline with the first names table, then
+        # the remaining ones with concurrent wikipedia searches
+        new = [x for x in pd.unique(pd.Series(names, dtype=object)) if x not in self._name_genders]
+        if len(new) > 0:
+            with self.metrics.stage('classification_store'):
+                stored = self.classification_store.get(new)
+            self.metrics.count('classification_store_hits', len(stored))
+            for x, (g, source, token) in stored.items():
+                self._name_genders[x] = g
+                self._name_sources[x] = source
+            new = [x for x in new if x not in stored]
+        merged = [x for x in new if NAME_SEPARATOR in x]
+        if len(merged) > 0:
+            # names of merged edges: classify each of their names, and keep the first non-neutral one
+            parts = {x: x.split(NAME_SEPARATOR) for x in merged}
+            self._classify_names(list(chain.from_iterable(parts.values())), workers=workers, progress=progress)
+            for x in merged:
+                first = next((p for p in parts[x] if self._name_genders[p] != 0), parts[x][0])
+                self._name_genders[x] = self._name_genders[first]
+                self._name_sources[x] = self._name_sources[first]
+            new = [x for x in new if NAME_SEPARATOR not in x]
+        if len(new) > 0:
+            for x in new: # names not normalized by this instance (e.g. read from the geometry cache)
+                if x not in self._name_tokens:
+                    self._name_tokens[x] = SPLIT_PATTERN.split(x)
+            with self.metrics.stage('name_table'):
+                offline = self._classify_offline([self._name_tokens[x] for x in new])
+            queries = [query for g, token, deps, query in offline if g is None and query is not None]
+            self.metrics.count('name_table_hits', sum(g is not None and query is None for g, token, deps, query in offline))
+            self.metrics.count('name_table_misses', sum(g is None for g, token, deps, query in offline))
+            self.metrics.count('fuzzy_hits', sum(g is not None and query is not None for g, token, deps, query in offline))
+            query_seconds = {} # total search time per query, to find the slowest names
+
+            def fetch(query, lang):
+                start = time.perf_counter()
+                results = self._wikipedia_results(query, lang)
+                query_seconds[query] = query_seconds.get(query, 0) + time.perf_counter() - start
+                return results
+
+            resolver = WikipediaResolver(fetch, self._classify_titles, languages=self.languages,
+                                         workers=workers, progress=progress)
+            with self.metrics.stage('wikipedia'):
+                found = resolver.resolve(queries)
+            records = []
+            for x, (g, token, deps, query) in zip(new, offline):
+                complete = True
+                if g is not None and query is not None:
+                    source = 'fuzzy'
+                elif g is not None:
+                    source = 'custom' if self.name_index.source(token) == 'custom' else 'table'
+                elif query is not None:
+                    g, lang, token, words, complete = found[query]
+                    deps = deps + words
+                    self.metrics.time_name(x, query_seconds.get(query, 0), query=query)
+                    source = f'wikipedia_{lang}' if g is not None else 'neutral'
+                else:
+                    source = 'neutral'
+                if g is None: # for the names still unclassified, assign 0 (neutral)
+                    g = 0
+                self._name_genders[x] = g
+                self._name_sources[x] = source
+                if complete: # don't store names classified without all their wikipedia results
+                    records.append((x, g, source, token, deps))
+            with self.metrics.stage('classification_store'):
+                self.classification_store.save(records)
+        return [self._name_genders[x] for x in names]
+
+
+    def classify_names(self, names, column='name', chunksize=10000, workers=8, cache_size=100000):
+        """
+        Classify street names that don't come from the road graph (e.g. from an address database),
+        in bounded memory. `names` is an iterable of raw names, a DataFrame or Series, or an iterable
+        of DataFrame chunks (e.g. `pd.read_csv(..., chunksize=...)`) whose names are read from
+        `column`. Names are normalized and classified like in `get_genders`, `chunksize` at a time,
+        and (name, gender, source) tuples are yielded in input order. Classifications are kept in
+        the persistent store, and the in-memory caches are emptied when they exceed `cache_size` names.
+        """
+        for chunk in _name_chunks(names, column, chunksize):
+            normalized = self._normalize_names(pd.Series(chunk, dtype=object)).tolist()
+            self._classify_names(list(dict.fromkeys(normalized)), workers=workers, progress=False)
+            yield from self._chunk_results(chunk, normalized)
+            self._trim_name_caches(cache_size)
+
+
+    async def aclassify_names(self, names, column='name', chunksize=10000, workers=8, cache_size=100000,
+                              prefetch=2):
+        """
+        Asynchronous variant of `classify_names`, also accepting async iterables of names or chunks.
+        Up to `prefetch` chunks are classified in background threads, so that the Wikipedia
+        searches of a chunk overlap with the reading, normalization and offline classification of
+        the next ones. Yields (name, gender, source) tuples in input order.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque() # (chunk, normalized names, classification future), in input order
+        try:
+            async for chunk in _aname_chunks(names, column, chunksize):
+                normalized = self._normalize_names(pd.Series(chunk, dtype=object)).tolist()
+                future = loop.run_in_executor(executor, self._classify_names, list(dict.fromkeys(normalized)),
+                                              workers, False)
+                pending.append((chunk, normalized, future))
+                # wait for the oldest chunk when enough chunks are in flight, and for all of them
+                # before emptying the caches they use
+                while len(pending) >= prefetch or (len(pending) > 0 and self._name_caches_full(cache_size)):
+                    chunk, normalized, future = pending.popleft()
+                    await future
+                    for row in self._chunk_results(chunk, normalized):
+                        yield row
+                self._trim_name_caches(cache_size)
+            while len(pending) > 0:
+                chunk, normalized, future = pending.popleft()
+                await future
+                for row in self._chunk_results(chunk, normalized):
+                    yield row
+        finally:
+            executor.shutdown(wait=False)
+
+
+    def _chunk_results(self, chunk: list, normalized: list):
+        genders, sources = self._name_genders, self._name_sources
+        return [(raw, genders[x], sources[x]) for raw, x in zip(chunk, normalized)]
+
+
+    def _name_caches_full(self, cache_size: int):
+        return len(self._name_memo) > cache_size or len(self._name_genders) > cache_size
+
+
+    def _trim_name_caches(self, cache_size: int):
+        # forget the in-memory normalizations and classifications when they get too many (the
+        # classifications are read again from the persistent store if needed)
+        if self._name_caches_full(cache_size):
+            self._name_memo = {}
+            self._name_tokens = {}
+            self._name_genders = {}
+            self._name_sources = {}
+
+
+    def _classifier_version(self):
+        # stored classifications are forgotten when the classifier, the rules, the languages or the matching change
+        return f"{CLASSIFIER_VERSION}-{self.rules.key}-{'+'.join(self.languages)}{'-fuzzy' if self.name_index.fuzzy else ''}"
+
+
+    def _classify_offline(self, names: list):
+        # for each road name (list of words), return the gender of its first known (possibly compound)
+        # first name, the name that decided it, the words the result depends on and, for the names
+        # that remained neutral, the word to search on wikipedia given by the rules - if this word
+        # is at one edit of a first name (fuzzy matching), its gender is returned along with the word
+        results = []
+        for name in names:
+            i, j, g, token = self.name_index.find(name)
+            if g is not None:
+                results.append((g, token, name[:j], None))
                 continue
+            query = self.rules.query(name)
+            g, token = self.name_index.fuzzy_get(query) if query is not None else (None, None)
+            deps = list(name)
+            if query is not None and self.name_index.fuzzy and len(query) >= self.name_index.min_fuzzy_length:
+                deps += ['~' + k for k in self.name_index.deletion_keys(query)] # changes at one edit of the query
+            if g is not None:
+                results.append((g, token, deps + [token], query))
+            else:
+                results.append((None, None, deps, query))
+        return results
 
-        # for the names that remained neutral, search wikipedia
-        if (g == None and len(name)==2) or \
-           (g == None and len(name)>3 and name[2] in ['de','d', 'du']): # case of 'Rue XX' or 'Rue XX de XX'
-            wikipedia.set_lang('en')
-            time.sleep(0.01)
-            results = wikipedia.search(name[1])[:3]
-            results = [re.split(" |\-|\'", k) for k in results]
-            results = list(chain.from_iterable(results))
-            for k in results:
-                k = unidecode(str.lower(str(k)))
-                try:
-                    g = int(self.gender_table[self.gender_table['preusuel']==k]['sexe'])
-                    break
-                except:
-                    continue
-            if g == None: # if name is still unclassified, search French wikipedia 
-                wikipedia.set_lang('fr')
-                results = wikipedia.search(name[1])[:3]
-                results = [re.split(" |\-|\'", k) for k in results]
-                results = list(chain.from_iterable(results))
-                for k in results:
-                    k = unidecode(str.lower(str(k)))
-                    try:
-                        g = int(self.gender_table[self.gender_table['preusuel']==k]['sexe'])
-                        break
-                    except:
-                        continue
 
-        elif g == None and len(name)==3 and name[1] in ['le','la', 'de', 'd']: # case of 'Rue de XX'
-            wikipedia.set_lang('en')
-            time.sleep(0.01)
-            results = wikipedia.search(name[2])[:3]
-            results = [re.split(" |\-|\'", k) for k in results]
-            results = list(chain.from_iterable(results))
-            for k in results:
-                k = unidecode(str.lower(str(k)))
-                try:
-                    g = int(self.gender_table[self.gender_table['preusuel']==k]['sexe'])
-                    break
-                except:
-                    continue
-            if g == None: # if name is still unclassified, search French wikipedia 
-                wikipedia.set_lang('fr')
-                results = wikipedia.search(name[2])[:3]
-                results = [re.split(" |\-|\'", k) for k in results]
-                results = list(chain.from_iterable(results))
-                for k in results:
-                    k = unidecode(str.lower(str(k)))
-                    try:
-                        g = int(self.gender_table[self.gender_table['preusuel']==k]['sexe'])
-                        break
-                    except:
-                        continue
-        
+    def _classify_gender(self, name: list):
+        g, token, deps, query = self._classify_offline([name])[0]
+        if g is None and query is not None:
+            g = self._search_wikipedia(query)
+
         if g == None: # for the names still unclassified, assign 0 (neutral)
             g = 0
 
         return g
 
+
+    def _search_wikipedia(self, query: str):
+        # classify the first name found in the top 3 results of the wikipedias of self.languages, in turn
+        resolver = WikipediaResolver(self._wikipedia_results, self._classify_titles, languages=self.languages,
+                                     workers=1, progress=False)
+        return resolver.resolve([query])[query][0]
+
+
+    def _classify_titles(self, results: list):
+        results = [SPLIT_PATTERN.split(k) for k in results[:3]]
+        results = [unidecode(str.lower(str(k))) for k in chain.from_iterable(results)]
+        i, j, g, token = self.name_index.find(results)
+        if g is None:
+            return None, None, results
+        return g, token, results[:j]
+
+
+    def _wikipedia_results(self, query: str, lang: str):
+        # read search results from the persistent cache, or query the search backend
+        # (returns None if the results are not available)
+        results = self.wikipedia_cache.get(lang, query)
+        if results is not None:
+            self.metrics.count('wikipedia_cache_hits', lang=lang)
+        else:
+            self.metrics.count('wikipedia_cache_misses', lang=lang)
+            if self.offline and not self.offline_search: # never touch the network in offline mode
+                return None
+            for attempt in range(self.wikipedia_retries + 1):
+                self._rate_limiter.wait()
+                self.metrics.count('wikipedia_calls', lang=lang)
+                try:
+                    results = list(self.search_backend(query, lang))
+                    break
+                except Exception:
+                    if attempt == self.wikipedia_retries: # give up on this query, without caching
+                        self.metrics.count('wikipedia_failures', lang=lang)
+                        return None
+                    self.metrics.count('wikipedia_retries', lang=lang)
+                    time.sleep(2 ** attempt)
+            self.wikipedia_cache.set(lang, query, results)
+        return results
+
+
+    def reload_dictionaries(self, gender_table=None):
+        """
+        Reload the first names table after `custom_dict` or `mistakes` were edited. Only the
+        names depending on modified words are forgotten, the others are read from the
+        persistent store by the next call to `get_genders`. Instances created with a
+        `gender_table` are given the new table the same way (e.g. `load_gender_table()`).
+        """
+        if gender_table is not None:
+            self.gender_table = gender_table
+        elif self._own_gender_table:
+            self.gender_table = load_gender_table(cache_folder=self.cache_folder, offline=self.offline)
+        else:
+            raise ValueError('This instance was created with a gender_table: pass the new table '
+                             'as reload_dictionaries(gender_table=...).')
+        self._own_gender_table = gender_table is None
+        self.name_index = NameIndex(self.gender_table, fuzzy=self.name_index.fuzzy)
+        n = self.classification_store.sync(self.name_index)
+        self._name_genders = {}
+        self._name_sources = {}
+        self._road_genders = None
+        self.street_names = None
+        self._edge_genders = None
+        self._edge_gender_array = None
+        self._edge_color_cache = None
+        print(f'{n} words changed in the first names table.')
+
     
-    def get_genders(self, gender=None):
-        tqdm.pandas()
+    def get_genders(self, gender=None, workers=8):
         if self._road_genders is not None:
             roads = self._road_genders
             if gender == None:
@@ -196,25 +1083,35 @@ class StreetGender:
                 roads = self._road_table
             else:
                 roads = self.road_table
-            print('Classifying streets...')
+            with self.metrics.stage('get_genders'):
+                print('Classifying streets...')
 
-            # create intermediate table with no duplicates to compute genders
-            roads['name_lower'] = roads['name'].apply(lambda x: unidecode(str.lower(str(x))))
-            intermediate = pd.DataFrame(roads['name_lower'].drop_duplicates())
-            intermediate['name_preprocessed'] = intermediate['name_lower'].apply(lambda x: re.split(" |\-|\'", x))
-            intermediate['gender'] = intermediate['name_preprocessed'].progress_apply(lambda x: self._classify_gender(name=x))
+                # dictionary-encode the normalized names, and classify each distinct name once
+                with self.metrics.stage('normalize_names'):
+                    names = self._normalize_names(roads['name']).astype('category')
+                street_names = pd.DataFrame({'name_lower': names.cat.categories})
+                street_names['name_preprocessed'] = [self._name_tokens[x] for x in street_names['name_lower']]
+                genders = self._classify_names(street_names['name_lower'], workers=workers)
+                street_names['gender'] = np.array(genders, dtype=np.int8)
+                street_names['source'] = pd.Categorical([self._name_sources[x] for x in street_names['name_lower']])
+                self.street_names = street_names
 
-            # merge back with roads table
-            roads = roads.merge(intermediate, on='name_lower')
-            self._road_genders = roads
+                # add the name codes, genders and sources to the roads table (the tokens are only kept
+                # once per name, in street_names)
+                codes = names.cat.codes.to_numpy()
+                sources = street_names['source'].cat
+                roads = roads.assign(name_lower=names,
+                                     gender=street_names['gender'].to_numpy()[codes],
+                                     source=pd.Categorical.from_codes(sources.codes.to_numpy()[codes], sources.categories))
+                self._road_genders = roads
+                self._edge_genders = dict(zip(zip(roads['u'], roads['v'], roads['key']), roads['gender']))
             
-            # store masc, fem and neutral streets in separate attributes
-            masc = list(roads[roads['gender']==1]['name'])
-            self.masculine = list(set([x for x in masc if type(x) == str])) # remove duplicated and list items
-            fem = list(roads[roads['gender']==2]['name'])
-            self.feminine = list(set([x for x in fem if type(x) == str]))
-            neut = list(roads[roads['gender']==0]['name'])
-            self.neutral = list(set([x for x in neut if type(x) == str]))
+                # store masc, fem and neutral streets in separate attributes (without duplicates and list items)
+                is_str = roads['name'].map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+                gender_values = roads['gender'].to_numpy()
+                self.masculine = roads['name'][is_str & (gender_values==1)].unique().tolist()
+                self.feminine = roads['name'][is_str & (gender_values==2)].unique().tolist()
+                self.neutral = roads['name'][is_str & (gender_values==0)].unique().tolist()
             
             if gender == None:
                 print('Street genders successfuly computed.')
@@ -230,53 +1127,125 @@ class StreetGender:
                     raise ValueError("Please pass 'M', 'F' or 'N' as gender argument.")
     
     
-    def plot_graph(self, colors=["silver", "cyan", "fuchsia"], legend_loc='lower left', save=False):
+    def save_genders(self, path: str):
+        """
+        Save the classified roads of the place as a compact Parquet (.parquet) or Arrow file,
+        read back with `load_results` (see `save_results`).
+        """
+        save_results(self.get_genders(), path, place=self.place)
+        print(f'Street genders successfully saved as {path}')
+
+
+    def street_stats(self, by=None, by_column=None, grid=None):
+        """
+        Statistics per gender (0 neutral, 1 masc, 2 fem) of the named streets: number of distinct
+        street names, kilometres of street, share of street names and share of length (in %).
+        Statistics can be computed per area: either per polygon of the GeoDataFrame `by` (e.g.
+        admin boundaries, labelled by its `by_column` column or its index), or per cell of a
+        regular grid of `grid` degrees. Edges are assigned to an area with the middle of their
+        end nodes, with a spatial index join for polygons.
+        """
         if self._road_genders is not None:
             roads = self._road_genders
         else:
             roads = self.get_genders()
+        named = (roads['name_lower'] != 'nan').to_numpy()
+        table = pd.DataFrame({'name_lower': roads['name_lower'].to_numpy()[named],
+                              'gender': roads['gender'].to_numpy()[named],
+                              'length': roads['length'].to_numpy(dtype=np.float64)[named]})
+
+        # assign edges to areas
+        keys = []
+        if grid is not None or by is not None:
+            x, y = self._edge_points(roads)
+            x, y = x[named], y[named]
+        if grid is not None:
+            table['x0'] = np.round(np.floor(np.round(x / grid, 9)) * grid, 6)
+            table['y0'] = np.round(np.floor(np.round(y / grid, 9)) * grid, 6)
+            keys = ['x0', 'y0']
+        elif by is not None:
+            import geopandas as gpd
+            polygons = by.to_crs('epsg:4326')
+            labels = polygons[by_column] if by_column is not None else polygons.index
+            polygons = gpd.GeoDataFrame({'area': labels.to_numpy()}, geometry=polygons.geometry.to_numpy(), crs='epsg:4326')
+            points = gpd.GeoDataFrame({'row': np.arange(len(table))}, geometry=gpd.points_from_xy(x, y), crs='epsg:4326')
+            # the `op` argument was renamed `predicate` in geopandas 0.10 (and removed in 1.0)
+            import inspect
+            predicate = 'predicate' if 'predicate' in inspect.signature(gpd.sjoin).parameters else 'op'
+            joined = gpd.sjoin(points, polygons, how='inner', **{predicate: 'within'})
+            table = table.iloc[joined['row'].to_numpy()].assign(area=joined['area'].to_numpy())
+            keys = ['area']
+
+        # aggregate per area and gender
+        stats = table.groupby(keys + ['gender']).agg(streets=('name_lower', 'nunique'), km=('length', 'sum'))
+        stats['km'] = stats['km'] / 1000
+        if len(keys) > 0:
+            totals = stats.groupby(level=keys).transform('sum')
+        else:
+            totals = stats.sum()
+        stats['street_share'] = round(100 * stats['streets'] / totals['streets'], 1)
+        stats['length_share'] = round(100 * stats['km'] / totals['km'], 1)
+        return stats.reset_index()
+
+
+    def _edge_points(self, roads):
+        # coordinates of the middle of the end nodes of each edge of the road table
+        if 'x' in roads.columns:
+            return roads['x'].to_numpy(dtype=np.float64), roads['y'].to_numpy(dtype=np.float64)
+        G = self.road_graph
+        xs = pd.Series(dict(G.nodes(data='x')))
+        ys = pd.Series(dict(G.nodes(data='y')))
+        x = (xs.reindex(roads['u']).to_numpy() + xs.reindex(roads['v']).to_numpy()) / 2
+        y = (ys.reindex(roads['u']).to_numpy() + ys.reindex(roads['v']).to_numpy()) / 2
+        return x, y
+
 
-        # add gender attribute to the road graph
-        # for that, we first add the gender column from `roads` to the full road geodataframe (`edges`),
-        # thanks to a common sorting order based on the ['name_lower'] column.
-        G = self._road_graph
-        edges = ox.graph_to_gdfs(G, nodes=False)
-        roads = roads.sort_values('name_lower', ignore_index=True) # sort `roads` on name_lower
-        edges['name_lower'] = edges['name'].apply(lambda x: unidecode(str.lower(str(x)))) 
-        edges = edges.sort_values('name_lower', ignore_index=True) # sort `edges` on name_lower
-        edges['gender'] = roads['gender'] # add gender column from `roads` to `edges` - everything should match!
-        for index, row in edges.iterrows():
-            G.edges[row['u'], row['v'], row['key']]['gender'] = row['gender']
-
-        # choose colors
-        gender_colors = LinearSegmentedColormap.from_list("mycmap", colors)
-        ec = ox.plot.get_edge_colors_by_attr(G, 'gender', cmap=gender_colors)
+    def _annotate_graph(self):
+        # set the gender attribute of the road graph edges in bulk, from the (u, v, key) -> gender
+        # mapping computed by get_genders, only once
+        import networkx as nx
+        G = self.road_graph
+        if self._edge_gender_array is None:
+            with self.metrics.stage('annotate_graph'):
+                if self.stats_only: # the road table holds OSM ways, so graph edges are matched by name
+                    edges = list(G.edges(keys=True, data='name'))
+                    names = self._normalize_names(pd.Series([e[3] for e in edges], dtype=object))
+                    self._edge_genders = dict(zip([e[:3] for e in edges], self._classify_names(names)))
+                nx.set_edge_attributes(G, self._edge_genders, 'gender')
+                genders = [self._edge_genders.get(e, 0) for e in G.edges(keys=True)]
+                self._edge_gender_array = np.array(genders, dtype=np.int8)
+        return G
+
+
+    def _edge_colors(self, colors: list):
+        # edge colors aligned with the road graph edges (neutral, masculine, feminine), also set as
+        # their 'edge_color' attribute - only recomputed when the colors change
+        if self._edge_color_cache is None or self._edge_color_cache[0] != tuple(colors):
+            import networkx as nx
+            G = self._annotate_graph()
+            ec = np.array(colors, dtype=object)[self._edge_gender_array].tolist()
+            nx.set_edge_attributes(G, dict(zip(G.edges(keys=True), ec)), 'edge_color')
+            self._edge_color_cache = (tuple(colors), ec)
+        return self._edge_color_cache[1]
+
+
+    def plot_graph(self, colors=["silver", "cyan", "fuchsia"], legend_loc='lower left', save=False):
+        if self._road_genders is None:
+            self.get_genders() # classify the streets first
+
+        # add gender and color attributes to the road graph
+        G = self._annotate_graph()
+        ec = self._edge_colors(colors)
 
         # plot graph
-        fig, ax = ox.plot_graph(G, edge_color=ec, bgcolor='white', node_size=0, figsize=(18, 18), show=False)
+        import matplotlib.pyplot as plt
+        with self.metrics.stage('plot_graph'):
+            fig, ax = self._osmnx().plot_graph(G, edge_color=ec, bgcolor='white', node_size=0, figsize=(18, 18), show=False)
 
         # plot legend
-        edges['name'] = edges['name'].apply(lambda x: '' if type(x)!=str else x)
-        edges = edges.drop_duplicates('name')
-        frequencies = round(edges['gender'].value_counts(normalize=True) * 100, 1)
-        freq_neut = frequencies[0]
-        try:
-            freq_masc = frequencies[1]
-        except:
-            freq_masc = 0
-        try: 
-            freq_fem = frequencies[2]
-        except:
-            freq_fem = 0
+        frequencies = self.street_stats().set_index('gender')['street_share']
         plt.rcParams["font.family"] = "monospace"
-        custom_lines = [Line2D([0], [0], color='cyan', lw=3),
-                        Line2D([0], [0], color='fuchsia', lw=3),
-                        Line2D([0], [0], color='silver', lw=3)]
-        l = ax.legend(custom_lines, 
-                  [f"Nom d'homme: {freq_masc}%", f"Nom de femme: {freq_fem}%", f"Neutre: {freq_neut}%"],
-                  title=f"Rues de {self.place}\nclassées par sexe\n",
-                  loc=legend_loc, frameon=False, fontsize='large')
-        plt.setp(l.get_title(), multialignment='center', family='monospace', weight='black', size=22)
+        self._plot_legend(ax, frequencies, colors, legend_loc)
         plt.show();
         
         # save as png
@@ -287,37 +1256,144 @@ class StreetGender:
             print(f'Map successfully saved as {str.lower(self.place)}_gendered_street_map.png')
 
     
-    def plot_folium(self, colors=["silver", "cyan", "fuchsia"], save=False):
-        if self._road_genders is not None:
-            roads = self._road_genders
-        else:
-            roads = self.get_genders()
+    def _plot_legend(self, ax, frequencies, colors, legend_loc='lower left'):
+        # legend with the share of street names of each gender (0 neutral, 1 masc, 2 fem)
+        from matplotlib.lines import Line2D
+        freq_neut = frequencies.get(0, 0)
+        freq_masc = frequencies.get(1, 0)
+        freq_fem = frequencies.get(2, 0)
+        custom_lines = [Line2D([0], [0], color=colors[1], lw=3),
+                        Line2D([0], [0], color=colors[2], lw=3),
+                        Line2D([0], [0], color=colors[0], lw=3)]
+        l = ax.legend(custom_lines, 
+                  [f"Nom d'homme: {freq_masc}%", f"Nom de femme: {freq_fem}%", f"Neutre: {freq_neut}%"],
+                  title=f"Rues de {self.place}\nclassées par sexe\n",
+                  loc=legend_loc, frameon=False, prop={'family': 'monospace', 'size': 'large'})
+        l.get_title().set(multialignment='center', family='monospace', weight='black', size=22)
+        return l
+
+
+    def render_maps(self, sizes=((18, 100),), colors=["silver", "cyan", "fuchsia"], legend_loc='lower left',
+                    folder='.', edge_width=1, refresh=False):
+        """
+        Render the static street map headlessly (no pyplot window) as PNG files, one per
+        (width in inches, dpi) of `sizes`, saved in `folder` as
+        `{place}_gendered_street_map_{width}in_{dpi}dpi.png`. The projected edge lines are
+        cached in `cache_folder` (see `_edge_geometry`), so that later renders of the place
+        neither fetch the road graph nor recompute its geometry; all sizes are rendered from
+        the same figure, with one line collection. Returns the paths of the files.
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import LineCollection
+
+        coords, offsets, names, lengths = self._edge_geometry(refresh=refresh)
+        with self.metrics.stage('render_maps'):
+            # genders of the edges, from the distinct names
+            codes, uniques = pd.factorize(names)
+            genders = np.array(self._classify_names(list(uniques), progress=False), dtype=np.int8)[codes]
+            named = names != 'nan'
+            frequencies = pd.Series(genders[named]).groupby(names[named]).first().value_counts(normalize=True)
+            frequencies = round(frequencies * 100, 1)
+
+            # draw all the edges at once, then save the figure at each size
+            fig = Figure(facecolor='white')
+            FigureCanvasAgg(fig)
+            ax = fig.add_axes([0, 0, 1, 1])
+            ax.axis('off')
+            lines = np.split(coords, offsets[1:-1])
+            ax.add_collection(LineCollection(lines, colors=np.array(colors, dtype=object)[genders].tolist(),
+                                             linewidths=edge_width, capstyle='round'))
+            xmin, ymin = coords.min(axis=0)
+            xmax, ymax = coords.max(axis=0)
+            mx, my = (xmax - xmin) * 0.02, (ymax - ymin) * 0.02
+            ax.set_xlim(xmin - mx, xmax + mx)
+            ax.set_ylim(ymin - my, ymax + my)
+            ax.set_aspect('equal')
+            self._plot_legend(ax, frequencies, colors, legend_loc)
+
+            os.makedirs(folder, exist_ok=True)
+            paths = []
+            for width, dpi in sizes:
+                fig.set_size_inches(width, width)
+                path = os.path.join(folder, f'{str.lower(self.place)}_gendered_street_map_{width}in_{dpi}dpi.png')
+                fig.savefig(path, dpi=dpi, facecolor='white', bbox_inches='tight')
+                paths.append(path)
+        print(f'{len(paths)} maps successfully saved in {folder}')
+        return paths
+
+
+    def _edge_geometry(self, refresh=False):
+        # edge lines of the road graph projected to meters around the place center, as one (n, 2)
+        # float32 coordinates array split by `offsets`, with the normalized name and the length
+        # of each edge - kept in memory and in cache_folder/geometry (built once per place)
+        if self._edge_geometry_cache is not None and not refresh:
+            return self._edge_geometry_cache
+        key = hashlib.sha1(repr((self.place, self.network_type, self.osm_file, self.boundary_file)).encode())
+        path = os.path.join(self.cache_folder, 'geometry',
+                            f'{_place_filename(self.place)[:-4]}-{key.hexdigest()[:10]}.npz')
+        if os.path.exists(path) and not refresh:
+            with np.load(path) as data:
+                uniques = data['names'].astype(object)
+                for x in uniques:
+                    self._name_tokens.setdefault(x, SPLIT_PATTERN.split(x))
+                names = uniques[data['codes']]
+                self._edge_geometry_cache = (data['coords'], data['offsets'], names, data['lengths'])
+            return self._edge_geometry_cache
+
+        with self.metrics.stage('edge_geometry'):
+            from osmnx import utils_graph
+            G = self.road_graph
+            edges = utils_graph.graph_to_gdfs(G, nodes=False, fill_edge_geometry=True)
+            lines = [np.asarray(geom.coords) for geom in edges.geometry]
+            counts = np.array([len(l) for l in lines])
+            lonlat = np.concatenate(lines)
+            lon0, lat0 = lonlat.mean(axis=0)
+            x = np.radians(lonlat[:, 0] - lon0) * np.cos(np.radians(lat0)) * 6371009
+            y = np.radians(lonlat[:, 1] - lat0) * 6371009
+            coords = np.column_stack([x, y]).astype(np.float32)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            names = self._normalize_names(edges['name']).to_numpy()
+            lengths = edges['length'].to_numpy(dtype=np.float32)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        codes, uniques = pd.factorize(names)
+        np.savez(path, coords=coords, offsets=offsets, codes=codes.astype(np.int32),
+                 names=np.array(uniques, dtype=str), lengths=lengths)
+        self._edge_geometry_cache = (coords, offsets, names, lengths)
+        return self._edge_geometry_cache
 
-        # add gender attribute to the road graph
-        # for that, we first add the gender column from `roads` to the full road geodataframe (`edges`),
-        # thanks to a common sorting order based on the ['name_lower'] column.
-        G = self._road_graph
-        edges = ox.graph_to_gdfs(G, nodes=False)
-        roads = roads.sort_values('name_lower', ignore_index=True) # sort `roads` on name_lower
-        edges['name_lower'] = edges['name'].apply(lambda x: unidecode(str.lower(str(x)))) 
-        edges = edges.sort_values('name_lower', ignore_index=True) # sort `edges` on name_lower
-        edges['gender'] = roads['gender'] # add gender column from `roads` to `edges` - everything should match!
-        for index, row in edges.iterrows():
-            G.edges[row['u'], row['v'], row['key']]['gender'] = row['gender']
-
-        # add color attribute to the road graph
-        edges = ox.graph_to_gdfs(G, nodes=False)
-        for index, row in edges.iterrows():
-            if row['gender'] == 1:
-                c = colors[1]
-            elif row['gender'] == 2:
-                c = colors[2]
-            else:
-                c = colors[0]
-            G.edges[row['u'], row['v'], row['key']]['edge_color'] = c
+
+    def plot_folium(self, colors=["silver", "cyan", "fuchsia"], save=False, mode='polylines',
+                    precision=5, tolerance=1e-5, zooms=range(11, 17)):
+        """
+        Plot the streets on a folium map. With mode='polylines', each edge is a folium PolyLine,
+        which is only usable for small places. With mode='geojson', the edges of each street are
+        merged into a single feature of one GeoJSON layer, simplified with `tolerance` (degrees)
+        and with coordinates rounded to `precision` decimals. With mode='tiles', the streets are
+        rendered as PNG tiles (for the `zooms` levels) saved next to the map, and only an
+        invisible GeoJSON layer is kept for the popups.
+        """
+        if self._road_genders is None:
+            self.get_genders() # classify the streets first
+
+        # add gender and color attributes to the road graph
+        G = self._annotate_graph()
+        self._edge_colors(colors)
 
         # plot the street network with folium and save as html if required
-        m = self._plot_graph_folium(G, popup_attribute='name', edge_width=2, tiles='cartodbpositron')
+        if mode not in ('polylines', 'geojson', 'tiles'):
+            raise ValueError("Please pass 'polylines', 'geojson' or 'tiles' as mode argument.")
+        with self.metrics.stage(f'plot_folium_{mode}'):
+            if mode == 'polylines':
+                m = self._plot_graph_folium(G, popup_attribute='name', edge_width=2, tiles='cartodbpositron')
+            elif mode == 'geojson':
+                m = self._plot_graph_geojson(G, popup_attribute='name', edge_width=2, tiles='cartodbpositron',
+                                             precision=precision, tolerance=tolerance)
+            else:
+                m = self._plot_graph_geojson(G, popup_attribute='name', edge_width=2, tiles='cartodbpositron',
+                                             precision=precision, tolerance=tolerance,
+                                             tiles_folder=f'{str.lower(self.place)}_tiles', zooms=zooms)
         if save:
             m.save(f'{str.lower(self.place)}_gendered_street_map.html')
             print(f'Map successfully saved as {str.lower(self.place)}_gendered_street_map.html')
@@ -333,7 +1409,10 @@ class StreetGender:
         Note that anything larger than a small city can take a long time to plot
         and create a large web map file that is very slow to load as JavaScript.
         """
-        
+        import folium
+        import osmnx as ox
+        from osmnx import utils_graph
+
         # create gdf of the graph edges
         gdf_edges = utils_graph.graph_to_gdfs(G, nodes=False, fill_edge_geometry=True)
 
@@ -367,6 +1446,595 @@ class StreetGender:
         return graph_map
 
 
+    @staticmethod
+    def _plot_graph_geojson(G, graph_map=None, popup_attribute=None,
+                            tiles="cartodbpositron", zoom=1, fit_bounds=True,
+                            edge_width=5, edge_opacity=1, precision=5, tolerance=1e-5,
+                            smooth_factor=1, tiles_folder=None, zooms=range(11, 17)):
+        """
+        Plot a networkx.MultiDiGraph on an interactive folium web map as a single GeoJSON layer,
+        with one feature per street (merged edges of the same name and color), simplified
+        geometries and rounded coordinates. Leaflet also simplifies the lines at each zoom level
+        (`smooth_factor`). If `tiles_folder` is set, the streets are drawn in PNG tiles
+        saved in this folder instead, and the GeoJSON layer is only kept (invisible) for popups.
+        """
+        import folium
+        from osmnx import utils_graph
+        from shapely.geometry import mapping
+
+        # create gdf of the graph edges
+        gdf_edges = utils_graph.graph_to_gdfs(G, nodes=False, fill_edge_geometry=True)
+        tb = gdf_edges.total_bounds
+
+        # create a new folium web map if one wasn't passed in through the graph_map argument
+        if graph_map is None:
+            graph_map = folium.Map(location=((tb[1] + tb[3]) / 2, (tb[0] + tb[2]) / 2), zoom_start=zoom, tiles=tiles)
+
+        # draw the streets in tiles if required
+        if tiles_folder is not None:
+            StreetGender._write_tiles(gdf_edges, tiles_folder, zooms, edge_width)
+            folium.TileLayer(tiles=tiles_folder + '/{z}/{x}/{y}.png', attr='StreetGender', overlay=True,
+                             min_zoom=min(zooms), max_native_zoom=max(zooms), max_zoom=18).add_to(graph_map)
+            edge_opacity = 0
+
+        # merge the edges of each street and simplify their geometry
+        if popup_attribute is not None:
+            names = gdf_edges[popup_attribute].map(lambda x: x if isinstance(x, str) else
+                                                   (' / '.join(map(str, x)) if isinstance(x, list) else ''))
+        else:
+            names = ''
+        streets = gdf_edges.assign(popup=names)[['popup', 'edge_color', 'geometry']]
+        streets = streets.dissolve(by=['popup', 'edge_color'], as_index=False)
+        streets['geometry'] = streets.geometry.simplify(tolerance)
+
+        # build the GeoJSON layer (including custom width, color and popups)
+        features = []
+        for popup, color, geom in zip(streets['popup'], streets['edge_color'], streets.geometry):
+            geom = mapping(geom)
+            if geom['type'] == 'LineString':
+                coords = np.round(np.asarray(geom['coordinates']), precision).tolist()
+            elif geom['type'] == 'MultiLineString':
+                coords = [np.round(np.asarray(c), precision).tolist() for c in geom['coordinates']]
+            else:
+                continue
+            features.append({'type': 'Feature', 'properties': {'name': popup, 'color': color},
+                             'geometry': {'type': geom['type'], 'coordinates': coords}})
+        layer = folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            style_function=lambda f: {'color': f['properties']['color'], 'weight': edge_width, 'opacity': edge_opacity},
+            smooth_factor=smooth_factor,
+            popup=folium.GeoJsonPopup(fields=['name'], labels=False) if popup_attribute is not None else None,
+        )
+        layer.add_to(graph_map)
+
+        # if fit_bounds is True, fit the map to the bounds of the route by passing
+        # list of lat-lng points as [southwest, northeast]
+        if fit_bounds and isinstance(graph_map, folium.Map):
+            bounds = [[tb[1], tb[0]], [tb[3], tb[2]]]
+            graph_map.fit_bounds(bounds)
+
+        return graph_map
+
+
+    @staticmethod
+    def _write_tiles(gdf_edges, folder, zooms, edge_width=2):
+        """
+        Render the edges (colored by their 'edge_color' column) as 256x256 transparent PNG
+        tiles, saved as `folder/{z}/{x}/{y}.png` for each zoom level (web mercator scheme).
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
+        # project the lines to web mercator pixels at zoom 0 (256 pixels for the whole world)
+        lines = []
+        for geom in gdf_edges.geometry:
+            lon, lat = np.asarray(geom.coords).T
+            lat = np.radians(lat)
+            x = (lon + 180) / 360 * 256
+            y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * 256
+            lines.append(np.column_stack([x, y]))
+        colors = gdf_edges['edge_color'].tolist()
+        xmin = np.array([l[:, 0].min() for l in lines])
+        xmax = np.array([l[:, 0].max() for l in lines])
+        ymin = np.array([l[:, 1].min() for l in lines])
+        ymax = np.array([l[:, 1].max() for l in lines])
+
+        # draw the lines crossing each tile, reusing the same figure
+        fig = plt.figure(figsize=(1, 1), dpi=256)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis('off')
+        for z in zooms:
+            scale = 2 ** z
+            for tx in range(int(xmin.min() * scale // 256), int(xmax.max() * scale // 256) + 1):
+                for ty in range(int(ymin.min() * scale // 256), int(ymax.max() * scale // 256) + 1):
+                    x0, y0 = tx * 256 / scale, ty * 256 / scale
+                    x1, y1 = x0 + 256 / scale, y0 + 256 / scale
+                    idx = np.flatnonzero((xmax >= x0) & (xmin <= x1) & (ymax >= y0) & (ymin <= y1))
+                    if len(idx) == 0:
+                        continue
+                    lc = LineCollection([lines[i] for i in idx], colors=[colors[i] for i in idx],
+                                        linewidths=edge_width * 72 / 256)
+                    ax.add_collection(lc)
+                    ax.set_xlim(x0, x1)
+                    ax.set_ylim(y1, y0)
+                    os.makedirs(os.path.join(folder, str(z), str(tx)), exist_ok=True)
+                    fig.savefig(os.path.join(folder, str(z), str(tx), f'{ty}.png'), dpi=256, transparent=True)
+                    lc.remove()
+        plt.close(fig)
+
+
+def _read_osm_ways(filepath: str, callback, network_type='drive', bounds=None):
+    # stream the ways of a .osm.pbf/.osm file with pyosmium and call `callback(way_id, nodes, tags)`
+    # for the ones of the network type (and crossing the `bounds` bbox, if any), with nodes as
+    # a list of (id, lon, lat)
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError('Reading local OSM files requires pyosmium (pip install osmium).')
+    filters = {k: re.compile(v) for k, v in NETWORK_FILTERS[network_type].items()}
+
+    class RoadWayHandler(osmium.SimpleHandler):
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if 'highway' not in tags or any(k in tags and p.search(tags[k]) for k, p in filters.items()):
+                return
+            nodes = [(n.ref, n.location.lon, n.location.lat) for n in w.nodes if n.location.valid()]
+            if len(nodes) < 2:
+                return
+            if bounds is not None and not any(bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]
+                                              for _, x, y in nodes):
+                return
+            callback(w.id, nodes, tags)
+
+    RoadWayHandler().apply_file(filepath, locations=True)
+
+
+def _filter_osm_file(filepath: str, output, network_type='drive', bounds=None):
+    # write the road ways of a .osm.pbf/.osm file and their nodes to an .osm XML file
+    written = set()
+
+    def write_way(way_id, nodes, tags):
+        for ref, x, y in nodes:
+            if ref not in written:
+                output.write(f'<node id="{ref}" lat="{y:.7f}" lon="{x:.7f}"/>\n')
+                written.add(ref)
+        output.write(f'<way id="{way_id}">')
+        output.write(''.join(f'<nd ref="{ref}"/>' for ref, _, _ in nodes))
+        output.write(''.join(f'<tag k={quoteattr(k)} v={quoteattr(v)}/>' for k, v in tags.items()))
+        output.write('</way>\n')
+
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="StreetGender">\n')
+    _read_osm_ways(filepath, write_way, network_type, bounds)
+    output.write('</osm>\n')
+
+
+def graph_from_osm_file(filepath: str, network_type='drive', boundary_file=None):
+    """
+    Build the road graph of a local OSM extract (.osm.pbf or .osm XML, e.g. from Geofabrik)
+    without any network access, like `ox.graph_from_place` does from the OSM APIs. Ways are
+    streamed and filtered on the `network_type`, and the graph is clipped to the polygon read
+    from `boundary_file` (any file read by geopandas, e.g. GeoJSON or shapefile) if given.
+    """
+    import geopandas as gpd
+    import osmnx as ox
+    from osmnx import utils_graph
+
+    polygon = None
+    if boundary_file is not None:
+        polygon = gpd.read_file(boundary_file).to_crs('epsg:4326').unary_union
+
+    # keep the road ways and their nodes only, then let osmnx build the graph
+    with tempfile.NamedTemporaryFile('w', suffix='.osm', delete=False, encoding='utf-8') as f:
+        _filter_osm_file(filepath, f, network_type, polygon.bounds if polygon is not None else None)
+    try:
+        G = ox.graph_from_xml(f.name, simplify=False, retain_all=True)
+    finally:
+        os.remove(f.name)
+
+    # clip to the boundary, simplify and keep the largest connected component
+    if polygon is not None:
+        G = ox.truncate.truncate_graph_polygon(G, polygon, retain_all=True)
+    G = ox.simplify_graph(G)
+    G = utils_graph.get_largest_component(G)
+    return G
+
+
+def _great_circle(lat1, lng1, lat2, lng2, earth_radius=6371009):
+    # vectorized great-circle distances in meters (same formula as osmnx's great_circle_vec,
+    # so that the OSM tables can be built without importing osmnx)
+    y1, y2 = np.deg2rad(lat1), np.deg2rad(lat2)
+    dy = y2 - y1
+    dx = np.deg2rad(lng2) - np.deg2rad(lng1)
+    h = np.sin(dy / 2) ** 2 + np.cos(y1) * np.cos(y2) * np.sin(dx / 2) ** 2
+    h = np.minimum(1.0, h) # protect against floating point errors
+    return 2 * np.arcsin(np.sqrt(h)) * earth_radius
+
+
+def _edge_table(ways: list, polygon=None):
+    """
+    Compact columnar table of road ways, with one row per way: `u` and `v` (first and last
+    node ids), `key` (always 0), `name` (categorical), `length` (meters, float32) and `x`/`y`
+    (middle of the first and last nodes, float64 so that grid cells in `street_stats` are exact). `ways` is
+    a list of (nodes, name) with nodes as a list of (id, lon, lat); only the way segments with
+    both ends in `polygon` (if any) are counted.
+    """
+    counts = np.array([len(nodes) for nodes, _ in ways], dtype=np.int64) # int even without any way
+    ways = [w for w, n in zip(ways, counts) if n >= 2]
+    counts = counts[counts >= 2]
+    points = np.array([p for nodes, _ in ways for p in nodes], dtype=np.float64).reshape(-1, 3)
+    ends = np.cumsum(counts) - 1
+    starts = ends - counts + 1
+
+    # segments between consecutive nodes of each way, with their length
+    is_start = np.ones(len(points), dtype=bool)
+    is_start[starts] = False
+    seg_way = np.repeat(np.arange(len(ways)), counts - 1)
+    seg_end = np.flatnonzero(is_start)
+    lengths = _great_circle(points[seg_end - 1, 2], points[seg_end - 1, 1], points[seg_end, 2], points[seg_end, 1])
+    if polygon is not None:
+        import geopandas as gpd
+        inside = gpd.GeoSeries(gpd.points_from_xy(points[:, 1], points[:, 2])).within(polygon).to_numpy()
+        lengths = np.where(inside[seg_end - 1] & inside[seg_end], lengths, np.nan)
+
+    # sum segments per way and drop the ways outside the polygon
+    length = np.bincount(seg_way, weights=np.nan_to_num(lengths), minlength=len(ways))
+    kept = np.bincount(seg_way, weights=~np.isnan(lengths), minlength=len(ways)) > 0
+    roads = pd.DataFrame({
+        'u': points[starts, 0].astype(np.int64),
+        'v': points[ends, 0].astype(np.int64),
+        'key': np.zeros(len(ways), dtype=np.int8),
+        'name': pd.Categorical([name for _, name in ways]),
+        'length': length.astype(np.float32),
+        'x': (points[starts, 1] + points[ends, 1]) / 2,
+        'y': (points[starts, 2] + points[ends, 2]) / 2,
+    })
+    return roads[kept].reset_index(drop=True)
+
+
+def edge_table_from_osm_file(filepath: str, network_type='drive', boundary_file=None):
+    """
+    Compact table of the road ways of a local OSM extract (see `_edge_table`), clipped to the
+    polygon of `boundary_file` if given, without building any graph.
+    """
+    polygon = None
+    if boundary_file is not None:
+        import geopandas as gpd
+        polygon = gpd.read_file(boundary_file).to_crs('epsg:4326').unary_union
+    ways = []
+    _read_osm_ways(filepath, lambda way_id, nodes, tags: ways.append((nodes, tags.get('name'))),
+                   network_type, polygon.bounds if polygon is not None else None)
+    return _edge_table(ways, polygon)
+
+
+def edge_table_from_place(place: str, network_type='drive'):
+    """
+    Compact table of the road ways of a place (see `_edge_table`), queried from Nominatim
+    and Overpass like `ox.graph_from_place` but without building any graph.
+    """
+    import osmnx as ox
+    polygon = ox.geocode_to_gdf(place)['geometry'].unary_union
+    coords = {}
+    paths = []
+    for response in ox.downloader._osm_network_download(polygon, network_type, None):
+        for el in response['elements']:
+            if el['type'] == 'node':
+                coords[el['id']] = (el['lon'], el['lat'])
+            elif el['type'] == 'way':
+                paths.append((el['nodes'], el.get('tags', {}).get('name')))
+    ways = [([(n, *coords[n]) for n in nodes if n in coords], name) for nodes, name in paths]
+    return _edge_table(ways, polygon)
+
+
+def _fetch_source(url: str, cache_folder='cache', offline=False, refresh=False):
+    """
+    Return the local path of a source file, downloading it into `cache_folder/sources`
+    the first time (or again if `refresh` is True). In offline mode, the network is never
+    used and a missing source raises an error.
+    """
+    path = os.path.join(cache_folder, 'sources', url.split('/')[-1])
+    if os.path.exists(path) and not refresh:
+        return path
+    if offline:
+        raise FileNotFoundError(f'{path} not found in cache and offline mode is on.')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with urllib.request.urlopen(url) as response:
+        data = response.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _build_gender_table(insee_path: str, nrs_path: str):
+    # clean INSEE's list of first names
+    genders = pd.read_csv(insee_path, sep=";")[['preusuel','sexe', 'nombre']]
+    genders['preusuel'] = genders['preusuel'].apply(lambda x: unidecode(str.lower(str(x))))
+    genders = genders.sort_values('nombre').drop_duplicates('preusuel', keep='last')
+    genders = genders[genders['nombre']>=100]
+    genders = genders[genders['preusuel']!='camille'] # remove Camille (2) as most street Camilles are men (1)
+    genders = genders[genders['preusuel']!='blanche']
+    genders = genders.reset_index(drop=True).drop(columns=['nombre'])
+    genders['source'] = 'insee'
+    
+    # add English first names
+    genders_en = pd.read_csv(nrs_path)[['sex','FirstForename','number']]
+    genders_en = genders_en[genders_en['number']>=20]
+    genders_en['preusuel'] = genders_en['FirstForename'].apply(lambda x: unidecode(str.lower(str(x))))
+    genders_en = genders_en.drop_duplicates('preusuel')
+    genders_en['sexe'] = genders_en['sex'].apply(lambda x: 1 if x=='B' else 2)
+    genders_en = genders_en.reset_index(drop=True).drop(columns=['FirstForename','number','sex'])
+    genders_en['source'] = 'nrs'
+
+    # add Italian first names
+    masc_it = re.split(', |[.\n ]', ragazzo)
+    masc_it = [x for x in masc_it if len(x)>0]
+    fem_it = re.split(', |[.\n ]', ragazza)
+    fem_it = [x for x in fem_it if len(x)>0]
+    genders_it = {}
+    for x in masc_it:
+        genders_it[x] = 1
+    for x in fem_it:
+        genders_it[x] = 2
+    genders_it = pd.DataFrame.from_dict(genders_it, orient='index')
+    genders_it = genders_it.reset_index()
+    genders_it.columns = ['preusuel','sexe']
+    genders_it['source'] = 'it'
+
+    # complement the gender table
+    more_names = pd.DataFrame.from_dict(custom_dict, orient='index')
+    more_names = more_names.reset_index()
+    more_names.columns = ['preusuel','sexe']
+    more_names['source'] = 'custom'
+    genders = pd.concat([genders, more_names, genders_en, genders_it], axis=0)
+    genders['preusuel'] = genders['preusuel'].apply(lambda x: unidecode(str.lower(str(x))))
+    genders = genders.drop_duplicates('preusuel')
+    genders = genders[~genders['preusuel'].isin(mistakes)]
+    genders =  genders.reset_index(drop=True)
+    return genders
+
+
+def load_gender_table(cache_folder='cache', offline=False, refresh=False):
+    """
+    Return the merged first names table used for classification. The normalized table is
+    stored in `cache_folder`, keyed by a hash of the INSEE and NRS source files, of the
+    Italian names and of `custom_dict`/`mistakes`: it is only rebuilt when one of them
+    changes, and later loads only read a pickle file. With `offline=True`, the table is
+    built from the cached source files only and the network is never used.
+    """
+    sources = [_fetch_source(url, cache_folder, offline, refresh) for url in [INSEE_URL, NRS_URL]]
+
+    # compute the cache key
+    key = hashlib.sha1(str(GENDER_TABLE_VERSION).encode())
+    for path in sources:
+        with open(path, 'rb') as f:
+            key.update(f.read())
+    key.update(json.dumps([custom_dict, mistakes, ragazzo, ragazza]).encode())
+    path = os.path.join(cache_folder, f'gender_table_{key.hexdigest()[:16]}.pkl')
+
+    # read the cached table or build and store it
+    if os.path.exists(path) and not refresh:
+        return pd.read_pickle(path)
+    print('Building first names table...')
+    genders = _build_gender_table(*sources)
+    genders.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return genders
+
+
+def save_results(roads: pd.DataFrame, path: str, place=None):
+    """
+    Save classified roads (as returned by `get_genders`) as a compact columnar file: Parquet if
+    `path` ends with .parquet, uncompressed Arrow IPC (Feather v2, memory-mappable) otherwise.
+    Place, names, normalized names and sources are dictionary-encoded, genders are int8 and
+    lengths float32. Tokens aren't saved, as they are given by the normalized names.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+    except ImportError:
+        raise ImportError('Saving results requires pyarrow (pip install pyarrow).')
+    # names of merged edges are saved as a single string, like OSM multi-valued tags
+    names = roads['name'].astype(object).map(lambda x: ';'.join(x) if isinstance(x, (list, tuple)) else x)
+    columns = {
+        'u': roads['u'].to_numpy(dtype=np.int64),
+        'v': roads['v'].to_numpy(dtype=np.int64),
+        'key': roads['key'].to_numpy(dtype=np.int8),
+        'name': pd.Categorical(names),
+        'name_lower': pd.Categorical(roads['name_lower']),
+        'gender': roads['gender'].to_numpy(dtype=np.int8),
+        'source': pd.Categorical(roads['source']),
+        'length': roads['length'].to_numpy(dtype=np.float32),
+    }
+    if place is not None:
+        columns = {'place': pd.Categorical.from_codes(np.zeros(len(roads), dtype=np.int8), [place]), **columns}
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+    if str(path).endswith('.parquet'):
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path, compression='uncompressed')
+
+
+def load_results(path, columns=None, places=None, memory_map=True):
+    """
+    Read classified roads saved with `save_results`, from a file, a list of files or a folder
+    of .parquet/.arrow/.feather files (e.g. one per city). Files are memory-mapped, only the
+    `columns` asked for are read, and only the rows of `places` are kept if given. Returns a
+    single table whose dictionary-encoded columns are categorical.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+    except ImportError:
+        raise ImportError('Loading results requires pyarrow (pip install pyarrow).')
+    if isinstance(path, str) and os.path.isdir(path):
+        paths = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(('.parquet', '.arrow', '.feather')))
+    elif isinstance(path, str):
+        paths = [path]
+    else:
+        paths = list(path)
+
+    read = columns
+    if columns is not None and places is not None and 'place' not in columns:
+        read = list(columns) + ['place']
+    frames = []
+    for p in paths:
+        if p.endswith('.parquet'):
+            table = pq.read_table(p, columns=read, memory_map=memory_map)
+        else:
+            table = feather.read_table(p, columns=read, memory_map=memory_map)
+        if places is not None:
+            keep = table.column('place').to_pandas().isin(places).to_numpy()
+            if not keep.any():
+                continue
+            table = table.filter(pa.array(keep))
+        frame = table.to_pandas()
+        frames.append(frame[list(columns)] if read is not columns else frame)
+    if len(frames) == 0:
+        raise ValueError('No results found for these places.' if places is not None else f'No results found in {path}.')
+    if len(frames) == 1:
+        return frames[0]
+
+    # concatenate, merging the dictionaries of the categorical columns instead of decoding them
+    categorical = [c for c in frames[0].columns if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+    results = pd.concat([f.drop(columns=categorical) for f in frames], ignore_index=True)
+    for c in categorical:
+        results[c] = pd.api.types.union_categoricals([f[c] for f in frames])
+    return results[frames[0].columns]
+
+
+# state shared by the processes of a batch run, set once per worker by _init_batch_worker
+_batch_worker = {}
+
+
+def _init_batch_worker(gender_table, kwargs):
+    _batch_worker['gender_table'] = gender_table
+    _batch_worker['kwargs'] = kwargs
+
+
+def _run_places(task, args: dict, workers: int, kwargs: dict, failures_path: str, desc='Places'):
+    # run `task(place, *args[place])` for each place in a pool of `workers` processes, whose
+    # StreetGender instances share one gender table and `kwargs` (with the global Wikipedia rate
+    # split between workers); returns the error message of each failed place, also saved as a
+    # (place, error) table in `failures_path`
+    failures = {}
+    if len(args) > 0:
+        gender_table = load_gender_table(cache_folder=kwargs['cache_folder'], offline=kwargs['offline'])
+        kwargs = dict(kwargs, wikipedia_rate=kwargs['wikipedia_rate'] / workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(gender_table, kwargs)) as pool:
+            futures = {pool.submit(task, place, *task_args): place for place, task_args in args.items()}
+            from tqdm import tqdm
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                place = futures[future]
+                try:
+                    error = future.result()
+                except Exception as e: # worker process crashed
+                    error = f'{type(e).__name__}: {e}'
+                if error is not None:
+                    failures[place] = error
+    pd.DataFrame({'place': list(failures.keys()), 'error': list(failures.values())},
+                 columns=['place', 'error']).to_csv(failures_path, index=False)
+    return failures
+
+
+def _place_filename(place: str):
+    return re.sub(r'[^\w\-]+', '_', str.lower(place)).strip('_') + '.csv'
+
+
+def _classify_place(place: str, path: str, wikipedia_workers: int):
+    # classify the streets of one place and save them as (place, street, gender, length),
+    # returning the error message instead of raising so that other places go on
+    try:
+        sg = StreetGender(place, gender_table=_batch_worker['gender_table'], **_batch_worker['kwargs'])
+        roads = sg.get_genders(workers=wikipedia_workers)
+        roads = roads.assign(street=roads['name'].map(sg._display_name))
+        roads = roads.dropna(subset=['street'])
+        streets = roads.groupby('street', sort=True).agg(gender=('gender', 'first'), length=('length', 'sum'))
+        streets = streets.reset_index()
+        streets.insert(0, 'place', place)
+        streets.to_csv(path + '.tmp', index=False)
+        sg.metrics.to_json(os.path.splitext(path)[0] + '.metrics.json')
+        os.replace(path + '.tmp', path)
+        return None
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+
+def run_batch(places: list, output_folder='batch', workers=4, wikipedia_workers=4,
+              network_type='drive', cache_folder='cache', offline=False, wikipedia_rate=20, **kwargs):
+    """
+    Classify the streets of several places in a pool of `workers` processes. The gender table
+    is loaded once and sent to every worker, and all instances share the same cache folder
+    (OSM responses, Wikipedia searches). The global Wikipedia rate is split between workers.
+
+    The result of each place is saved to `output_folder/places` as soon as it is computed, and
+    places that already have a result file are skipped: an interrupted batch resumes where it
+    stopped. A failing place doesn't stop the others, failures are listed in
+    `output_folder/failures.csv` (and retried on the next run). The instrumentation report of
+    each place (see `Metrics`) is saved next to its result as a .metrics.json file.
+    Returns the consolidated table (place, street, gender, length), also saved as
+    `output_folder/street_genders.csv`.
+    """
+    os.makedirs(os.path.join(output_folder, 'places'), exist_ok=True)
+    paths = {place: os.path.join(output_folder, 'places', _place_filename(place)) for place in places}
+    todo = [place for place in places if not os.path.exists(paths[place])]
+    print(f'{len(places) - len(todo)} places already done, {len(todo)} to classify.')
+
+    # classify the remaining places
+    kwargs = dict(kwargs, network_type=network_type, cache_folder=cache_folder, offline=offline,
+                  wikipedia_rate=wikipedia_rate)
+    failures = _run_places(_classify_place, {place: (paths[place], wikipedia_workers) for place in todo},
+                           workers, kwargs, os.path.join(output_folder, 'failures.csv'))
+    if len(failures) > 0:
+        print(f'{len(failures)} places failed, see {os.path.join(output_folder, "failures.csv")}.')
+
+    # consolidate the results of all places
+    tables = [pd.read_csv(paths[place]) for place in places if os.path.exists(paths[place])]
+    if len(tables) > 0:
+        results = pd.concat(tables, ignore_index=True)
+    else:
+        results = pd.DataFrame(columns=['place', 'street', 'gender', 'length'])
+    results.to_csv(os.path.join(output_folder, 'street_genders.csv'), index=False)
+    print(f'Street genders of {len(tables)} places saved as {os.path.join(output_folder, "street_genders.csv")}')
+    return results
+
+
+def _render_place(place: str, folder: str, render_kwargs: dict):
+    # render the maps of one place, returning the error message instead of raising
+    try:
+        sg = StreetGender(place, gender_table=_batch_worker['gender_table'], **_batch_worker['kwargs'])
+        sg.render_maps(folder=folder, **render_kwargs)
+        return None
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+
+def render_batch(places: list, output_folder='maps', workers=4, sizes=((18, 100),),
+                 colors=["silver", "cyan", "fuchsia"], legend_loc='lower left', edge_width=1, refresh=False,
+                 network_type='drive', cache_folder='cache', offline=False, wikipedia_rate=20, **kwargs):
+    """
+    Render the static maps of several places (see `StreetGender.render_maps`) in a pool of
+    `workers` processes sharing one gender table and one cache folder, at every size of `sizes`.
+    The projected geometry of each place is cached, so rendering the same places again at other
+    sizes only reads the cache and the stored classifications. `colors`, `legend_loc`,
+    `edge_width` and `refresh` (recompute the geometry) are passed to `render_maps`, the other
+    keyword arguments to `StreetGender`. Failures are listed in `output_folder/failures.csv`
+    without stopping the other places.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    kwargs = dict(kwargs, network_type=network_type, cache_folder=cache_folder, offline=offline,
+                  wikipedia_rate=wikipedia_rate)
+    render_kwargs = {'sizes': sizes, 'colors': colors, 'legend_loc': legend_loc, 'edge_width': edge_width,
+                     'refresh': refresh}
+    failures = _run_places(_render_place, {place: (output_folder, render_kwargs) for place in places},
+                           workers, kwargs, os.path.join(output_folder, 'failures.csv'), desc='Maps')
+    print(f'Maps of {len(places) - len(failures)} places saved in {output_folder}'
+          + (f', {len(failures)} places failed.' if len(failures) > 0 else '.'))
+    return failures
+
+
 custom_dict = {
             # titles
             'Maréchal':1, 'Maréchaux':1, 'Général':1, 'Capitaine':1, 'Commandant':1, 'Adjudant':1,
@@ -459,9 +2127,17 @@ custom_dict = {
             'bruxelles':0,
             }
 
+# first names removed from the gender table as they mostly refer to places or things in street names
+mistakes = ['france', 'alma', 'barbe', 'lilas', 'milan', 'brune', 'felicite',
+            'nancy', 'grace', 'lorraine', 'evy', 'loup', 'iris',
+            'colombe', 'jan', 'harmonie', 'julienne', 'abbey', 'andrea', 'kim',
+            'brittany', 'river', 'line', 'lou', 'tracy', 'yvette', 'sonia',
+            'india', 'leah', 'pamela', 'stacey', 'eliza', 'athena', 'prince',
+            'violet', 'desiree', 'vivienne', 'charlie']
+
 # Italian first names
 url = 'https://www.rinonline.it/studenti_nomi_propri_persona.htm'
-masc = """Agostino, Alberto, Alessandro, Alessio, Alfio, Alfonso, Amedeo, Angelo, Antonio, Aurelio. 
+ragazzo = """Agostino, Alberto, Alessandro, Alessio, Alfio, Alfonso, Amedeo, Angelo, Antonio, Aurelio. 
         Baldassarre, Baldo, Bastiano, Bartolo, Bartolomeo, Benito,  Bernardo, Biagio, Boris, Bruno.
         Calogero, Carlo, Carmelo,  Casimiro, Cesare, Cirillo, Ciro,  Claudio, Corrado, Cosimo.
         Daniele, Danilo, Dante, Dario, Davide, Diego, Dino, Dionisio, Domenico, Duccio.
@@ -0,0 +1,311 @@
+"""
+Benchmarks of the StreetGender pipeline on synthetic data, without any network access.
+
+A synthetic first names table, a generated grid of streets (written as a local .osm extract)
+and a fake Wikipedia search backend with a configurable latency replace the INSEE, NRS, OSM
+and Wikipedia sources. For each city size, the wall time, the peak memory allocated by the
+stage and the throughput (names/sec and edges/sec) of each stage are reported.
+
+    python benchmark.py --sizes 10 30 60 --latency 0.02
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from xml.sax.saxutils import quoteattr
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import networkx as nx
+import pandas as pd
+
+import StreetGender as sg
+
+
+FIRST_SYLLABLES = ['ma', 'ri', 'jo', 'an', 'el', 'lu', 'ca', 'to', 'ni', 'se', 'ra', 'li', 'ge', 'no', 'be', 'ta']
+LAST_SYLLABLES = ['dur', 'mont', 'fer', 'blanc', 'gar', 'vil', 'berg', 'cour', 'lam', 'pers', 'rou', 'chev']
+STREET_TYPES = ['Rue', 'Avenue', 'Boulevard', 'Place', 'Allée', 'Impasse']
+
+
+def synthetic_gender_table(n_names=2000, seed=0):
+    """Random first names table with the columns of the real one (`preusuel`, `sexe`, `source`)."""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_names:
+        names.add(''.join(rng.choice(FIRST_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    names = sorted(names)
+    return pd.DataFrame({'preusuel': names, 'sexe': [rng.choice([1, 2]) for _ in names], 'source': 'synthetic'})
+
+
+def synthetic_street_names(n_streets, first_names, seed=0):
+    """
+    Random street names following the usual French patterns: 'Rue Prénom Nom' (classified with
+    the first names table), 'Rue Nom' and 'Place du Nom' (classified with Wikipedia) and
+    'Rue des Noms' (neutral).
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_streets:
+        last = ''.join(rng.choice(LAST_SYLLABLES) for _ in range(rng.randint(1, 3))).title()
+        kind = rng.random()
+        if kind < 0.4:
+            name = f'{rng.choice(STREET_TYPES)} {rng.choice(first_names).title()} {last}'
+        elif kind < 0.7:
+            name = f'{rng.choice(STREET_TYPES)} {last}'
+        elif kind < 0.85:
+            name = f'{rng.choice(STREET_TYPES)} du {last}'
+        else:
+            name = f'{rng.choice(STREET_TYPES)} des {last}s'
+        names.add(name)
+    return sorted(names)
+
+
+def synthetic_streets(size, first_names, block=5, seed=0):
+    """
+    Grid of `size` x `size` intersections (about 80m apart) in which rows and columns are cut
+    into streets of `block` edges. Returns the node coordinates {id: (lon, lat)} and the
+    streets as a list of (node ids, name).
+    """
+    coords = {i * size + j + 1: (2.3 + i * 0.001, 48.85 + j * 0.0007) for i in range(size) for j in range(size)}
+    lines = [[i * size + j + 1 for j in range(size)] for i in range(size)]
+    lines += [[i * size + j + 1 for i in range(size)] for j in range(size)]
+    segments = [line[k:k + block + 1] for line in lines for k in range(0, size - 1, block)]
+    names = synthetic_street_names(max(len(segments) // 2, 1), first_names, seed=seed)
+    rng = random.Random(seed)
+    streets = [(nodes, rng.choice(names) if rng.random() > 0.05 else None) for nodes in segments]
+    return coords, streets
+
+
+def write_osm_file(path, coords, streets):
+    """Write the synthetic streets as an OSM XML extract, read by `graph_from_osm_file`."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6' generator='StreetGender benchmark'>\n")
+        for node, (lon, lat) in coords.items():
+            f.write(f"  <node id='{node}' lat='{lat:.7f}' lon='{lon:.7f}' version='1'/>\n")
+        for way, (nodes, name) in enumerate(streets, start=1):
+            f.write(f"  <way id='{way}' version='1'>\n")
+            f.writelines(f"    <nd ref='{node}'/>\n" for node in nodes)
+            f.write("    <tag k='highway' v='residential'/>\n")
+            if name is not None:
+                f.write(f"    <tag k='name' v={quoteattr(name)}/>\n")
+            f.write("  </way>\n")
+        f.write("</osm>\n")
+
+
+def synthetic_graph(coords, streets):
+    """Undirected road graph of the synthetic streets, with the attributes of an OSMnx graph."""
+    G = nx.MultiGraph(crs='epsg:4326', name='benchmark')
+    for node, (lon, lat) in coords.items():
+        G.add_node(node, x=lon, y=lat, osmid=node)
+    for way, (nodes, name) in enumerate(streets, start=1):
+        for u, v in zip(nodes[:-1], nodes[1:]):
+            (x1, y1), (x2, y2) = coords[u], coords[v]
+            length = sg._great_circle(y1, x1, y2, x2)
+            attributes = {'osmid': way, 'highway': 'residential', 'oneway': False, 'length': length}
+            if name is not None:
+                attributes['name'] = name
+            G.add_edge(u, v, **attributes)
+    return G
+
+
+class FakeWikipedia:
+    """
+    Search backend standing in for `wikipedia_search`: waits `latency` seconds, then returns
+    deterministic titles, naming a person (with a first name of the table) for about half
+    of the queries.
+    """
+
+    def __init__(self, first_names, latency=0.02):
+        self.first_names = list(first_names)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, query: str, lang: str):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        h = int(hashlib.md5(f'{lang}:{query}'.encode()).hexdigest(), 16)
+        if h % 2:
+            return [f'{self.first_names[h % len(self.first_names)].title()} {query.title()}',
+                    f'{query.title()} (homonymie)']
+        return [f'{query.title()} (commune)', f'Famille {query.title()}']
+
+
+IMPORT_SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+import StreetGender
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+print(seconds, rss, len(sys.modules))
+"""
+
+
+def measure_import(repeat=3):
+    """
+    Cold import time of the module, in fresh interpreters (best of `repeat`), with the max
+    resident memory and the number of modules loaded by the import.
+    """
+    folder = os.path.dirname(os.path.abspath(sg.__file__))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=folder, capture_output=True,
+                             text=True, check=True).stdout.split()
+        runs.append((float(out[0]), float(out[1]), int(out[2])))
+    seconds, rss, modules = min(runs)
+    return {'seconds': round(seconds, 4), 'max_rss_mb': round(rss, 1), 'modules': modules}
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    # hide the progress messages and bars of the pipeline
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def measure(func, memory=True, verbose=False):
+    """Run `func` and return its result, its wall time and the peak memory it allocated."""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with quiet(not verbose):
+        result = func()
+    seconds = time.perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_size(size, gender_table, folder, latency=0.02, workers=8, rate=1000, folium_modes=('geojson',),
+                   osm_file=True, memory=True, verbose=False, fuzzy=False):
+    first_names = gender_table['preusuel'].tolist()
+    coords, streets = synthetic_streets(size, first_names, seed=size)
+    backend = FakeWikipedia(first_names, latency=latency)
+    place = f'benchmark-{size}'
+    cache_folder = os.path.join(folder, f'cache-{size}')
+    osm_path = os.path.join(folder, f'{place}.osm')
+    write_osm_file(osm_path, coords, streets)
+    options = dict(cache_folder=cache_folder, gender_table=gender_table, search_backend=backend,
+                   wikipedia_rate=rate, osm_file=osm_path if osm_file else None, fuzzy=fuzzy)
+    rows = []
+
+    def record(stage, func, names=None, edges=None):
+        result, seconds, peak = measure(func, memory=memory, verbose=verbose)
+        rows.append({'size': size, 'stage': stage, 'seconds': round(seconds, 4),
+                     'peak_mb': round(peak / 2**20, 2) if memory else None,
+                     'names_per_s': round(names / seconds, 1) if names else None,
+                     'edges_per_s': round(edges / seconds, 1) if edges else None})
+        return result
+
+    street_gender = record('__init__', lambda: sg.StreetGender(place, **options))
+    if osm_file:
+        G = record('road_graph', lambda: street_gender.road_graph)
+    else:
+        G = record('road_graph', lambda: synthetic_graph(coords, streets))
+        street_gender._road_graph = G
+    n_edges = G.number_of_edges()
+    n_names = len({name for _, name in streets if name is not None})
+
+    rows[-1]['edges_per_s'] = round(n_edges / rows[-1]['seconds'], 1)
+
+    if osm_file:
+        with quiet(not verbose):
+            stats_only = sg.StreetGender(place, stats_only=True, **options)
+        table = record('road_table (stats_only)', lambda: stats_only.road_table)
+        rows[-1]['edges_per_s'] = round(len(table) / rows[-1]['seconds'], 1)
+
+    record('get_genders (cold)', lambda: street_gender.get_genders(workers=workers), names=n_names, edges=n_edges)
+    calls = backend.calls
+
+    # a second instance reads the classifications stored by the first one
+    with quiet(not verbose):
+        warm = sg.StreetGender(place, **options)
+    warm._road_graph = G
+    record('get_genders (warm)', lambda: warm.get_genders(workers=workers), names=n_names, edges=n_edges)
+    record('street_stats', street_gender.street_stats, edges=n_edges)
+
+    record('plot_graph', lambda: (street_gender.plot_graph(), plt.close('all')), edges=n_edges)
+    record('render_maps (2 sizes)', lambda: street_gender.render_maps(sizes=[(18, 100), (6, 150)], folder=folder),
+           edges=n_edges)
+
+    # a new instance renders from the cached geometry only, with an empty classification store
+    # (names never normalized by this instance), then again with the names it just classified
+    with quiet(not verbose):
+        cached = sg.StreetGender(place, **options)
+    cached.classification_store.clear()
+    for stage in ['cold store', 'warm']:
+        record(f'render_maps (cached geometry, {stage})', lambda: cached.render_maps(folder=folder), edges=n_edges)
+    assert cached._road_graph is None, 'render_maps fetched the road graph despite the geometry cache'
+    cwd = os.getcwd()
+    os.chdir(folder) # maps and tiles are saved in the current folder
+    try:
+        for mode in folium_modes:
+            record(f'plot_folium ({mode})', lambda: street_gender.plot_folium(save=True, mode=mode), edges=n_edges)
+    finally:
+        os.chdir(cwd)
+
+    for row in rows:
+        row.update(nodes=G.number_of_nodes(), edges=n_edges, names=n_names, wikipedia_calls=calls)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 30, 60],
+                        help='number of intersections per side of the generated street grids')
+    parser.add_argument('--latency', type=float, default=0.02, help='latency of the fake Wikipedia backend (seconds)')
+    parser.add_argument('--workers', type=int, default=8, help='number of Wikipedia threads')
+    parser.add_argument('--rate', type=float, default=1000, help='max Wikipedia requests per second')
+    parser.add_argument('--first-names', type=int, default=2000, help='size of the synthetic first names table')
+    parser.add_argument('--folium-modes', nargs='*', default=['geojson'], help='plot_folium modes to measure')
+    parser.add_argument('--fuzzy', action='store_true', help='enable fuzzy first names matching')
+    parser.add_argument('--no-osm-file', action='store_true',
+                        help='generate the graph directly instead of reading a local .osm extract')
+    parser.add_argument('--no-memory', action='store_true',
+                        help="don't trace memory allocations (tracing slows every stage down)")
+    parser.add_argument('--output', help='save the results as a csv file')
+    parser.add_argument('--verbose', action='store_true', help='show the progress messages of the pipeline')
+    args = parser.parse_args(argv)
+
+    gender_table = synthetic_gender_table(args.first_names)
+    folder = tempfile.mkdtemp(prefix='streetgender-benchmark-')
+    cold = measure_import()
+    rows = [{'size': 0, 'nodes': 0, 'edges': 0, 'names': 0, 'wikipedia_calls': 0, 'stage': 'import (cold)',
+             'seconds': cold['seconds']}]
+    try:
+        for size in args.sizes:
+            rows += benchmark_size(size, gender_table, folder, latency=args.latency, workers=args.workers,
+                                   rate=args.rate, folium_modes=args.folium_modes, osm_file=not args.no_osm_file,
+                                   memory=not args.no_memory, verbose=args.verbose, fuzzy=args.fuzzy)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    results = pd.DataFrame(rows)[['size', 'nodes', 'edges', 'names', 'wikipedia_calls', 'stage', 'seconds',
+                                  'peak_mb', 'names_per_s', 'edges_per_s']]
+    print(f"Cold import: {cold['seconds']}s, {cold['max_rss_mb']} MB max resident memory, "
+          f"{cold['modules']} modules loaded")
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])